@@ -1,57 +1,41 @@
-from eventregistry import *
+import sys
 import json
+import logging
 import argparse
+import traceback
 import pdb
+from multiprocessing.pool import ThreadPool
 
-# parse the input arguments
-parser = argparse.ArgumentParser()
-parser.add_argument("keyword", help="Keyword to categorize.")
-parser.add_argument("outputFile", help="Path to output file. (json)")
-parser.add_argument("-a", "--apiKey", help="Event Registry API key (obtainable on you ER profile page).")
-parser.add_argument("-c", "--max_concept_suggestions", action="store", type=int, default=3, help="Maximum number of concept suggestions (default: 3)")
-parser.add_argument("-e", "--max_related_events", action="store", type=int, default=3, help="Maximum number of related events (default: 3)")
-parser.add_argument("-r", "--cutoff_related_events", action="store", type=int, default=0, help="Relatedness to the query cutoff; values in [0, 100] (default: 0 - all events)")
-parser.add_argument("-k", "--events_for_keyword", action="store_true", default=False, help="get [max_related_events] directly related to the given keyword (default: [max_related_events] events per suggested concept)")
-parser.add_argument("-ga", "--get_articles", action="store_true", default=False, help="get ER article URLs for the events")
-parser.add_argument("-ma", "--max_articles_per_event", action="store", type=int, default=-1, help="Maximum number of articles per event (default: all)")
-args = parser.parse_args()
-
-# connect to Event Registry and log in if API key provided
-
-if args.apiKey:
-    er = EventRegistry(apiKey = args.apiKey)
-else:
-    er = EventRegistry()
-
-query_result = {}
-
-# get top most likely URIc for the keyword - the number of suggestions is given as parameter
-query_result['concept_suggestions'] = er.suggestConcepts(args.keyword)[:args.max_concept_suggestions]
-
-# get concept category information fo all suggested concepts
-q = GetConceptInfo(
-    [cs['uri'] for cs in query_result['concept_suggestions']],
-    returnInfo = ReturnInfo(
-        conceptInfo = ConceptInfoFlags(
-            conceptClassMembership = True,
-            conceptClassMembershipFull = True)))
-concept_info = er.execQuery(q)
-
-# copy the category info into the result json
-for concept_suggestion in query_result['concept_suggestions']:
-    concept_suggestion['categories'] = concept_info[concept_suggestion['uri']]['conceptClassMembershipFull']
-    concept_suggestion['topCategory'] = concept_info[concept_suggestion['uri']]['conceptClassMembership']
-
-# returned event info is the same for both types of queries
-returnInfoSpec = ReturnInfo(
-        eventInfo = EventInfoFlags(
-            title = True,
-            summary = False,
-            articleCounts = False,
-            concepts = False,
-            categories = False,
-            location = True,
-            date = True))
+from er_client import EventRegistryClient, FakeERClient, CachingERClient, RateLimitedERClient
+from er_client import CACHE_TTL, MAX_IN_FLIGHT, REQUEST_RATE, REQUEST_BURST
+from er_client import CONCEPT_INFO_BATCH_SIZE, EVENT_ARTICLES_BATCH_SIZE, ARTICLES_PAGE_SIZE
+
+# number of keywords categorized together in batch mode
+KEYWORD_GROUP_SIZE = 50
+
+
+def get_er_client(
+        api_key = None,
+        cache = "er_cache.sqlite",
+        no_cache = False,
+        cache_ttl = CACHE_TTL,
+        fake = False,
+        max_in_flight = MAX_IN_FLIGHT,
+        rate = REQUEST_RATE,
+        burst = REQUEST_BURST):
+    """
+    Connect to Event Registry (log in if API key provided) and answer repeated queries from the cache.
+    At most max_in_flight requests are sent to ER at once and at most rate of them per second.
+    """
+    if fake:
+        er = FakeERClient()
+    else:
+        er = EventRegistryClient(api_key)
+    # only requests that miss the cache are rate limited
+    er = RateLimitedERClient(er, max_in_flight, rate, burst)
+    if not no_cache:
+        er = CachingERClient(er, cache, ttl = cache_ttl)
+    return er
 
 
 def build_event(event_info):
@@ -66,77 +50,266 @@ def build_event(event_info):
     return event
 
 
-def get_articles(event_uri, er, max_articles):
-    """Download articles for the event."""
-    # prepare query for articles
-    artQuery = QueryEventArticlesIter(event_uri)
-    # build an iterator over evet articles
-    artIter = artQuery.execQuery(
-        er,
-        maxItems = max_articles,
-        returnInfo = ReturnInfo(
-            articleInfo = ArticleInfoFlags(
-                bodyLen = 0,
-                title = False,
-                body = False,
-                eventUri = False)))
-    # collect article source urls
-    articles = [article["url"] for article in artIter]
-    return articles
-
-
-# return either top related events for the suggested concepts or directly for the keyord
-if args.events_for_keyword:
-# get related events for the keyword
-    q = QueryEventsIter(
-        keywords = args.keyword,
-        lang = ['eng']) # events should have english info)
-    keyword_event_iter = q.execQuery(
-        er,
-        sortBy = 'rel',
-        maxItems = args.max_related_events,
-        returnInfo = returnInfoSpec)
+def chunks(items, size):
+    """Split a list into consecutive chunks of at most size items."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def unique(items):
+    """Drop repeated items, keep the order of their first occurrence."""
+    seen = set()
+    return [item for item in items if not (item in seen or seen.add(item))]
+
+
+def batched_lookup(lookup, uris, batch_size, map_func = map):
+    """
+    Look up the distinct URIs in batches of at most batch_size with lookup (returning {uri: value})
+    and merge the results; the batches are sent with map_func.
+    """
+    results = {}
+    for batch_results in map_func(lookup, chunks(unique(uris), batch_size)):
+        results.update(batch_results)
+    return results
+
 
-    query_result['related_events'] = []
-    for event_info in keyword_event_iter:
+def get_related_events(event_infos, cutoff_related_events):
+    """Build the related events until they are not related enough anymore."""
+    related_events = []
+    for event_info in event_infos:
         # stop when events are not related enough anymore
-        if event_info['wgt'] < args.cutoff_related_events:
+        if event_info['wgt'] < cutoff_related_events:
             break
 
         # clean up the returned json
-        event = build_event(event_info)
-        # get event articles if specified
-        if args.get_articles:
-            event['articles'] = get_articles(event['uri'], er, args.max_articles_per_event)
-
-        query_result['related_events'].append(event)
-else:
-    # get related events for each concept
-    for concept_suggestion in query_result['concept_suggestions']:
-        q = QueryEventsIter(
-            conceptUri=concept_suggestion['uri'],
-            lang=['eng']) # events should have english info
-
-        concept_event_iter = q.execQuery(
-            er,
-            sortBy = 'rel',
-            maxItems = args.max_related_events,
-            returnInfo = returnInfoSpec)
-
-        concept_suggestion['related_events'] = []
-        for event_info in concept_event_iter:
-            # stop when events are not related enough anymore
-            if event_info['wgt'] < args.cutoff_related_events:
-                break
-
-            # clean up the returned json
-            event = build_event(event_info)
-            # get event articles if specified
-            if args.get_articles:
-                event['articles'] = get_articles(event['uri'], er, args.max_articles_per_event)
-
-            concept_suggestion['related_events'].append(event)
-
-print "outputing results to: %s" % args.outputFile
-with open(args.outputFile, 'w') as outfile:
-    json.dump(query_result, outfile, indent=2)
+        related_events.append(build_event(event_info))
+    return related_events
+
+
+def add_event_articles(events, er, max_articles_per_event, map_func = map):
+    """
+    Download the article urls of all events and add them to the events (all of them if max_articles_per_event is -1).
+    The urls are fetched page by page, each page for all the events that still have more articles
+    in as few ER requests as possible.
+    """
+    event_uris = unique([event['uri'] for event in events])
+    event_articles = dict((event_uri, []) for event_uri in event_uris)
+    if max_articles_per_event < 0:
+        page_size = ARTICLES_PAGE_SIZE
+    else:
+        page_size = min(max_articles_per_event, ARTICLES_PAGE_SIZE)
+
+    page = 1
+    pending = event_uris if page_size > 0 else []
+    while pending:
+        articles_page = batched_lookup(
+            lambda uris: er.events_articles_page(uris, page, page_size),
+            pending,
+            EVENT_ARTICLES_BATCH_SIZE,
+            map_func)
+        still_pending = []
+        for event_uri in pending:
+            urls = articles_page[event_uri]['urls']
+            event_articles[event_uri].extend(urls)
+            # stop at the last page or when there are enough articles
+            if (len(urls) == page_size
+                    and page * page_size < articles_page[event_uri]['total']
+                    and (max_articles_per_event < 0 or len(event_articles[event_uri]) < max_articles_per_event)):
+                still_pending.append(event_uri)
+        pending = still_pending
+        page += 1
+
+    for event in events:
+        event_urls = event_articles[event['uri']]
+        event['articles'] = event_urls[:max_articles_per_event] if max_articles_per_event >= 0 else list(event_urls)
+
+
+def categorize_many(
+        keywords,
+        er,
+        max_concept_suggestions = 3,
+        max_related_events = 3,
+        cutoff_related_events = 0,
+        events_for_keyword = False,
+        get_articles = False,
+        max_articles_per_event = -1,
+        pool = None):
+    """
+    Categorize several keywords at once and return their results (see categorize) in the same order.
+    Concept info and event articles are looked up for the concepts and events of all keywords together,
+    in batches as large as ER allows, and the results are fanned out to the keywords.
+    If a thread pool is given, the ER queries of each step are run concurrently on it.
+    """
+    map_func = pool.map if pool is not None else map
+    query_results = [{} for keyword in keywords]
+
+    # get top most likely URIc for each keyword - the number of suggestions is given as parameter
+    concept_suggestions = map_func(lambda keyword: er.suggest_concepts(keyword)[:max_concept_suggestions], keywords)
+    for query_result, keyword_suggestions in zip(query_results, concept_suggestions):
+        query_result['concept_suggestions'] = keyword_suggestions
+    all_suggestions = [cs for keyword_suggestions in concept_suggestions for cs in keyword_suggestions]
+
+    # get concept category information for the suggested concepts of all keywords
+    concept_info = batched_lookup(
+        er.concept_info,
+        [cs['uri'] for cs in all_suggestions],
+        CONCEPT_INFO_BATCH_SIZE,
+        map_func)
+
+    # copy the category info into the result json
+    for concept_suggestion in all_suggestions:
+        concept_suggestion['categories'] = concept_info[concept_suggestion['uri']]['conceptClassMembershipFull']
+        concept_suggestion['topCategory'] = concept_info[concept_suggestion['uri']]['conceptClassMembership']
+
+    # return either top related events for the suggested concepts or directly for the keyord
+    if events_for_keyword:
+        # get related events for each keyword
+        keyword_events = map_func(lambda keyword: er.keyword_events(keyword, max_related_events), keywords)
+        for query_result, event_infos in zip(query_results, keyword_events):
+            query_result['related_events'] = get_related_events(event_infos, cutoff_related_events)
+        all_events = [event for query_result in query_results for event in query_result['related_events']]
+    else:
+        # get related events for each concept
+        concept_events = map_func(
+            lambda concept_suggestion: er.concept_events(concept_suggestion['uri'], max_related_events),
+            all_suggestions)
+        for concept_suggestion, event_infos in zip(all_suggestions, concept_events):
+            concept_suggestion['related_events'] = get_related_events(event_infos, cutoff_related_events)
+        all_events = [event for cs in all_suggestions for event in cs['related_events']]
+
+    # get event articles if specified
+    if get_articles:
+        add_event_articles(all_events, er, max_articles_per_event, map_func)
+
+    return query_results
+
+
+def categorize(keyword, er, **categorize_args):
+    """
+    Return likely concepts the keyword could identify in ER along with their category information
+    and a small set of related events (see readme.txt for the result structure).
+    er is an ER client (see get_er_client and er_client.py); the remaining parameters match the command line options
+    (see categorize_many).
+    """
+    return categorize_many([keyword], er, **categorize_args)[0]
+
+
+def iter_keywords(infile):
+    """Read keywords from a file, one per line (empty lines are skipped)."""
+    for line in infile:
+        keyword = line.strip()
+        if keyword:
+            yield keyword.decode('utf8') if isinstance(keyword, bytes) else keyword
+
+
+def iter_groups(items, size):
+    """Group an iterable into lists of at most size items."""
+    group = []
+    for item in items:
+        group.append(item)
+        if len(group) >= size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def categorize_batch(keywords, er, outfile, group_size = KEYWORD_GROUP_SIZE, **categorize_args):
+    """
+    Categorize keywords with a single ER client and write one json line per keyword.
+    Keywords are categorized in groups of group_size, so the ER requests of a group are batched together.
+    Each line holds the keyword and its result; if a keyword fails its line holds the error instead.
+    """
+    keyword_n = error_n = 0
+    for group in iter_groups(keywords, group_size):
+        try:
+            results = categorize_many(group, er, **categorize_args)
+        except Exception:
+            # find the failing keywords by categorizing the group one keyword at a time
+            traceback.print_exc()
+            results = []
+            for keyword in group:
+                try:
+                    results.append(categorize(keyword, er, **categorize_args))
+                except Exception as e:
+                    traceback.print_exc()
+                    results.append({'error': str(e)})
+                    error_n += 1
+        for keyword, result in zip(group, results):
+            result['keyword'] = keyword
+            outfile.write(json.dumps(result) + '\n')
+            keyword_n += 1
+        outfile.flush()
+    logging.info("Categorized %d keywords (%d failed)" % (keyword_n, error_n))
+
+
+def main():
+    # parse the input arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("keyword", help="Keyword to categorize. With --batch a file with one keyword per line (- for stdin).")
+    parser.add_argument("outputFile", help="Path to output file. (json; jsonl with --batch, - for stdout)")
+    parser.add_argument("-a", "--apiKey", help="Event Registry API key (obtainable on you ER profile page).")
+    parser.add_argument("-c", "--max_concept_suggestions", action="store", type=int, default=3, help="Maximum number of concept suggestions (default: 3)")
+    parser.add_argument("-e", "--max_related_events", action="store", type=int, default=3, help="Maximum number of related events (default: 3)")
+    parser.add_argument("-r", "--cutoff_related_events", action="store", type=int, default=0, help="Relatedness to the query cutoff; values in [0, 100] (default: 0 - all events)")
+    parser.add_argument("-k", "--events_for_keyword", action="store_true", default=False, help="get [max_related_events] directly related to the given keyword (default: [max_related_events] events per suggested concept)")
+    parser.add_argument("-ga", "--get_articles", action="store_true", default=False, help="get ER article URLs for the events")
+    parser.add_argument("-ma", "--max_articles_per_event", action="store", type=int, default=-1, help="Maximum number of articles per event (default: all)")
+    parser.add_argument("-b", "--batch", action="store_true", default=False, help="categorize all keywords from the keyword file and write a json line per keyword")
+    parser.add_argument("--group_size", action="store", type=int, default=KEYWORD_GROUP_SIZE, help="Number of keywords whose ER requests are batched together with --batch (default: %d)" % KEYWORD_GROUP_SIZE)
+    parser.add_argument("--cache", action="store", default="er_cache.sqlite", help="SQLite file caching ER responses between runs (default: er_cache.sqlite)")
+    parser.add_argument("--no_cache", action="store_true", default=False, help="always query ER, do not use the response cache")
+    parser.add_argument("--cache_ttl", action="store", type=float, default=CACHE_TTL / 3600, help="hours before cached ER responses expire (default: %d)" % (CACHE_TTL / 3600))
+    parser.add_argument("--fake", action="store_true", default=False, help="use made-up ER responses instead of connecting to ER (for offline testing)")
+    parser.add_argument("--max_in_flight", action="store", type=int, default=MAX_IN_FLIGHT, help="Maximum number of concurrent ER requests (default: %d)" % MAX_IN_FLIGHT)
+    parser.add_argument("--rate", action="store", type=float, default=REQUEST_RATE, help="Maximum average number of ER requests per second; 0 for no limit (default: %g)" % REQUEST_RATE)
+    parser.add_argument("--burst", action="store", type=int, default=REQUEST_BURST, help="Maximum number of ER requests sent at once before the rate limit applies (default: %d)" % REQUEST_BURST)
+    args = parser.parse_args()
+
+    # log to stderr, so the results can be written to stdout
+    logging.basicConfig(format='%(asctime)s| %(message)s', datefmt='%H:%M:%S', level=logging.INFO)
+
+    er = get_er_client(
+        args.apiKey,
+        args.cache,
+        args.no_cache,
+        args.cache_ttl * 3600,
+        args.fake,
+        args.max_in_flight,
+        args.rate,
+        args.burst)
+    # the client limits the requests sent to ER, the pool only needs enough threads to keep them in flight
+    pool = ThreadPool(args.max_in_flight)
+    categorize_args = {
+        'max_concept_suggestions': args.max_concept_suggestions,
+        'max_related_events': args.max_related_events,
+        'cutoff_related_events': args.cutoff_related_events,
+        'events_for_keyword': args.events_for_keyword,
+        'get_articles': args.get_articles,
+        'max_articles_per_event': args.max_articles_per_event,
+        'pool': pool}
+
+    try:
+        if args.batch:
+            infile = sys.stdin if args.keyword == '-' else open(args.keyword)
+            outfile = sys.stdout if args.outputFile == '-' else open(args.outputFile, 'w')
+            try:
+                categorize_batch(iter_keywords(infile), er, outfile, args.group_size, **categorize_args)
+            finally:
+                if infile is not sys.stdin:
+                    infile.close()
+                if outfile is not sys.stdout:
+                    outfile.close()
+        else:
+            query_result = categorize(args.keyword, er, **categorize_args)
+
+            print "outputing results to: %s" % args.outputFile
+            with open(args.outputFile, 'w') as outfile:
+                json.dump(query_result, outfile, indent=2)
+    finally:
+        pool.close()
+        pool.join()
+        er.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Checks of the ER response cache (hits, misses, TTL expiry and eviction) against FakeERClient,
+so they run without the eventregistry module or network access:
+
+    python check_cache.py
+"""
+import os
+import time
+import shutil
+import logging
+import tempfile
+
+from er_client import FakeERClient, CachingERClient
+
+
+class RecordingERClient(FakeERClient):
+    """FakeERClient that also records the concept URIs it was asked about."""
+
+    def __init__(self):
+        FakeERClient.__init__(self)
+        self.concept_uris = []
+
+    def concept_info(self, concept_uris):
+        self.concept_uris.extend(concept_uris)
+        return FakeERClient.concept_info(self, concept_uris)
+
+
+def check_hits(cache_fnm):
+    fake = RecordingERClient()
+    er = CachingERClient(fake, cache_fnm)
+    first = er.suggest_concepts(u'Barack Obama')
+    # the same keyword up to case and whitespace is answered from the cache
+    assert er.suggest_concepts(u'  barack   OBAMA ') == first
+    assert fake.calls['suggest_concepts'] == 1, fake.calls
+    assert (er.hits, er.misses) == (1, 1), (er.hits, er.misses)
+
+    # concept info is cached per concept, only the uncached concepts are looked up
+    er.concept_info([u'a', u'b'])
+    info = er.concept_info([u'b', u'c'])
+    assert sorted(info) == [u'b', u'c']
+    assert fake.concept_uris == [u'a', u'b', u'c'], fake.concept_uris
+
+    # pages of event articles are cached per event, page and page size
+    er.events_articles_page([u'e1', u'e2'], 1, 3)
+    er.events_articles_page([u'e2', u'e3'], 1, 3)
+    er.events_articles_page([u'e1', u'e2'], 2, 3)
+    er.events_articles_page([u'e1'], 1, 3)
+    assert fake.calls['events_articles_page'] == 3, fake.calls
+    er.close()
+
+    # the cache persists between runs
+    fake = RecordingERClient()
+    er = CachingERClient(fake, cache_fnm)
+    assert er.suggest_concepts(u'barack obama') == first
+    assert er.concept_info([u'a', u'c']) == FakeERClient().concept_info([u'a', u'c'])
+    assert sum(fake.calls.values()) == 0, fake.calls
+    er.close()
+
+
+def check_ttl(cache_fnm):
+    fake = FakeERClient()
+    er = CachingERClient(fake, cache_fnm, ttl = 0.5)
+    er.concept_events(u'http://en.wikipedia.org/wiki/Slovenia', 3)
+    er.concept_events(u'http://en.wikipedia.org/wiki/Slovenia', 3)
+    assert fake.calls['concept_events'] == 1, fake.calls
+    time.sleep(0.6)
+    # the expired response is fetched again and cached anew
+    er.concept_events(u'http://en.wikipedia.org/wiki/Slovenia', 3)
+    er.concept_events(u'http://en.wikipedia.org/wiki/Slovenia', 3)
+    assert fake.calls['concept_events'] == 2, fake.calls
+    assert er.entry_n == 1, er.entry_n
+    er.close()
+
+
+def check_eviction(cache_fnm):
+    fake = FakeERClient()
+    er = CachingERClient(fake, cache_fnm, max_entries = 10)
+    for i in range(10):
+        er.keyword_events(u'keyword %d' % i, 3)
+    # keep the first keyword recently used
+    er.keyword_events(u'keyword 0', 3)
+    er.keyword_events(u'keyword 10', 3)
+    # the least recently used responses are evicted down to 90% of the limit
+    assert er.entry_n == 9, er.entry_n
+    calls = fake.calls['keyword_events']
+    er.keyword_events(u'keyword 0', 3)
+    assert fake.calls['keyword_events'] == calls, "recently used response was evicted"
+    er.keyword_events(u'keyword 1', 3)
+    assert fake.calls['keyword_events'] == calls + 1, "least recently used response was not evicted"
+    er.close()
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s| %(message)s', datefmt='%H:%M:%S', level=logging.WARNING)
+    tmp_dir = tempfile.mkdtemp(prefix = 'check_cache_')
+    try:
+        check_hits(os.path.join(tmp_dir, 'hits.sqlite'))
+        check_ttl(os.path.join(tmp_dir, 'ttl.sqlite'))
+        check_eviction(os.path.join(tmp_dir, 'eviction.sqlite'))
+    finally:
+        shutil.rmtree(tmp_dir)
+    print "all cache checks passed"
+
+
+if __name__ == '__main__':
+    main()
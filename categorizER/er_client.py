@@ -0,0 +1,387 @@
+"""
+Event Registry (ER) client layer used by categorizER.py.
+
+The clients answer the lookups categorizER needs with plain json data; they all provide
+the same methods, so they can be used in place of each other and wrapped into each other:
+- suggest_concepts(keyword): concepts (dicts with uri, label, score, ...) the keyword could identify,
+- concept_info(concept_uris): {concept_uri: info} with the category information (conceptClassMembership[Full]),
+- keyword_events(keyword, max_events) and concept_events(concept_uri, max_events):
+  up to max_events english events related to the keyword or concept, most related first,
+- events_articles_page(event_uris, page, count): {event_uri: {'urls': article source urls, 'total': article count}}
+  with the given page (1, 2, ...) of count articles of each event,
+- close(): release the client (and the clients it wraps).
+
+- EventRegistryClient sends them to ER through the eventregistry module,
+- FakeERClient answers them with deterministic made-up data (for offline use and testing),
+- CachingERClient stores the answers of another client in a persistent SQLite cache
+  (with TTL and size based eviction), so repeated keywords and concepts do not use up the ER API quota,
+- RateLimitedERClient limits the number of concurrent and the rate of lookups sent to another client.
+"""
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import Counter
+
+# how long cached ER responses are valid (in seconds)
+CACHE_TTL = 7 * 24 * 3600
+# maximal number of cached responses; the least recently used ones are evicted
+CACHE_MAX_ENTRIES = 100000
+# most concept or event URIs sent to ER in a single request (ER limits the length of URI lists)
+CONCEPT_INFO_BATCH_SIZE = 50
+EVENT_ARTICLES_BATCH_SIZE = 50
+# most articles ER returns per event in a single request (eventregistry allows at most 100 from version 8 on)
+ARTICLES_PAGE_SIZE = 100
+# maximal number of concurrent ER lookups, their average rate (per second) and the largest burst
+MAX_IN_FLIGHT = 4
+REQUEST_RATE = 5.0
+REQUEST_BURST = 5
+
+
+def normalize_keyword(keyword):
+    """Normalize a keyword for cache keys (case and whitespace do not change ER results)."""
+    return u' '.join(keyword.lower().split())
+
+
+class EventRegistryClient(object):
+    """Client sending queries to Event Registry with the eventregistry module."""
+
+    def __init__(self, api_key=None):
+        # imported here so the other clients work without the eventregistry module
+        import eventregistry
+        self.er_module = eventregistry
+        if api_key:
+            self.er = eventregistry.EventRegistry(apiKey=api_key)
+        else:
+            self.er = eventregistry.EventRegistry()
+        # returned event info is the same for both types of event queries
+        self.event_return_info = eventregistry.ReturnInfo(
+            eventInfo=eventregistry.EventInfoFlags(
+                title=True,
+                summary=False,
+                articleCounts=False,
+                concepts=False,
+                categories=False,
+                location=True,
+                date=True))
+
+    def suggest_concepts(self, keyword):
+        return self.er.suggestConcepts(keyword)
+
+    def concept_info(self, concept_uris):
+        ER = self.er_module
+        q = ER.GetConceptInfo(
+            concept_uris,
+            returnInfo=ER.ReturnInfo(
+                conceptInfo=ER.ConceptInfoFlags(
+                    conceptClassMembership=True,
+                    conceptClassMembershipFull=True)))
+        return self.er.execQuery(q)
+
+    def _events(self, q, max_events):
+        event_iter = q.execQuery(
+            self.er,
+            sortBy='rel',
+            maxItems=max_events,
+            returnInfo=self.event_return_info)
+        return list(event_iter)
+
+    def keyword_events(self, keyword, max_events):
+        # events should have english info
+        return self._events(self.er_module.QueryEventsIter(keywords=keyword, lang=['eng']), max_events)
+
+    def concept_events(self, concept_uri, max_events):
+        # events should have english info
+        return self._events(self.er_module.QueryEventsIter(conceptUri=concept_uri, lang=['eng']), max_events)
+
+    def events_articles_page(self, event_uris, page, count):
+        ER = self.er_module
+        # a page of articles of all the events in a single request
+        q = ER.QueryEvent(event_uris)
+        q.setRequestedResult(ER.RequestEventArticles(
+            page=page,
+            count=count,
+            returnInfo=ER.ReturnInfo(
+                articleInfo=ER.ArticleInfoFlags(
+                    bodyLen=0,
+                    title=False,
+                    body=False,
+                    eventUri=False))))
+        response = self.er.execQuery(q)
+        pages = {}
+        for event_uri in event_uris:
+            # results of each event are returned under its uri as {"articles": {"results": [...], "totalResults": n, ...}}
+            event_articles = response.get(event_uri, {}).get('articles', {})
+            urls = [article["url"] for article in event_articles.get('results', [])]
+            pages[event_uri] = {'urls': urls, 'total': event_articles.get('totalResults', len(urls))}
+        return pages
+
+    def close(self):
+        pass
+
+
+class FakeERClient(object):
+    """
+    Client answering with deterministic made-up data without connecting to ER.
+    Each lookup can be delayed by latency seconds to mimic round trips; the number of calls per lookup is counted in calls.
+    """
+
+    def __init__(self, latency=0, concept_n=5, event_n=10, article_n=5):
+        self.latency = latency
+        self.concept_n = concept_n
+        self.event_n = event_n
+        self.article_n = article_n
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def _call(self, name):
+        with self.lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _id(self, text):
+        return hashlib.md5(text.encode('utf8')).hexdigest()[:8]
+
+    def suggest_concepts(self, keyword):
+        self._call('suggest_concepts')
+        title = u'_'.join(normalize_keyword(keyword).split()).capitalize()
+        return [{
+            'uri': u'http://en.wikipedia.org/wiki/%s_%d' % (title, i),
+            'label': {'eng': u'%s %d' % (keyword, i)},
+            'score': 1000 // (i + 1),
+            'type': 'wiki',
+            'id': self._id(u'%s %d' % (title, i))} for i in range(self.concept_n)]
+
+    def concept_info(self, concept_uris):
+        self._call('concept_info')
+        return dict((uri, {
+            'conceptClassMembership': [u'dbo:Category_%s' % self._id(uri)[0]],
+            'conceptClassMembershipFull': [u'dbo:Category_%s' % c for c in self._id(uri)[:3]]}) for uri in concept_uris)
+
+    def _events(self, query, max_events):
+        event_n = self.event_n if max_events < 0 else min(max_events, self.event_n)
+        return [{
+            'uri': u'eng-%s' % self._id(u'%s %d' % (query, i)),
+            'title': {'eng': u'Event %d about %s' % (i, query)},
+            'location': None,
+            'eventDate': u'2016-02-%02d' % (i + 1),
+            'wgt': 100 - 10 * i} for i in range(event_n)]
+
+    def keyword_events(self, keyword, max_events):
+        self._call('keyword_events')
+        return self._events(keyword, max_events)
+
+    def concept_events(self, concept_uri, max_events):
+        self._call('concept_events')
+        return self._events(concept_uri, max_events)
+
+    def events_articles_page(self, event_uris, page, count):
+        self._call('events_articles_page')
+        first = (page - 1) * count
+        return dict((event_uri, {
+            'urls': [u'http://news.example.com/%s/%d' % (event_uri, i) for i in range(first, min(first + count, self.article_n))],
+            'total': self.article_n}) for event_uri in event_uris)
+
+    def close(self):
+        pass
+
+
+class CachingERClient(object):
+    """
+    Client answering from a persistent SQLite cache and asking the given client only on misses.
+    Cached responses expire after ttl seconds; when there are more than max_entries of them
+    the least recently used ones are evicted. Keys are built from the normalized queries;
+    concept info and pages of event articles are cached per URI, so only uncached URIs are looked up.
+    """
+
+    def __init__(self, client, cache_fnm, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # the connection is shared by all threads using the client
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(cache_fnm, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_by_access ON responses (accessed)")
+        self.conn.commit()
+        self.entry_n = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def _key(self, *query):
+        return json.dumps(query)
+
+    def _get(self, key):
+        """Return the cached response or None if it is missing or expired."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def _put(self, key, value):
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute("UPDATE responses SET value = ?, created = ?, accessed = ? WHERE key = ?", (json.dumps(value), now, now, key))
+            if cursor.rowcount == 0:
+                self.conn.execute("INSERT INTO responses VALUES (?, ?, ?, ?)", (key, json.dumps(value), now, now))
+                self.entry_n += 1
+            if self.entry_n > self.max_entries:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        # drop expired responses and then the least recently used ones down to 90% of the limit
+        self.conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        self.entry_n = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        excess = self.entry_n - int(self.max_entries * 0.9)
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)", (excess,))
+            self.entry_n -= excess
+        logging.info("Evicted ER cache entries, %d left" % self.entry_n)
+
+    def _cached(self, key, fetch):
+        value = self._get(key)
+        if value is None:
+            value = fetch()
+            self._put(key, value)
+        return value
+
+    def suggest_concepts(self, keyword):
+        return self._cached(
+            self._key('suggest_concepts', normalize_keyword(keyword)),
+            lambda: self.client.suggest_concepts(keyword))
+
+    def _cached_uris(self, lookup, uris, fetch, *params):
+        """Answer a lookup of several URIs from the cache and fetch only the missing ones (fetch returns {uri: value})."""
+        values = {}
+        missing_uris = []
+        for uri in uris:
+            value = self._get(self._key(lookup, uri, *params))
+            if value is None:
+                missing_uris.append(uri)
+            else:
+                values[uri] = value
+        if missing_uris:
+            fetched_values = fetch(missing_uris)
+            for uri in missing_uris:
+                if uri in fetched_values:
+                    self._put(self._key(lookup, uri, *params), fetched_values[uri])
+                    values[uri] = fetched_values[uri]
+        return values
+
+    def concept_info(self, concept_uris):
+        return self._cached_uris('concept_info', concept_uris, self.client.concept_info)
+
+    def keyword_events(self, keyword, max_events):
+        return self._cached(
+            self._key('keyword_events', normalize_keyword(keyword), max_events),
+            lambda: self.client.keyword_events(keyword, max_events))
+
+    def concept_events(self, concept_uri, max_events):
+        return self._cached(
+            self._key('concept_events', concept_uri, max_events),
+            lambda: self.client.concept_events(concept_uri, max_events))
+
+    def events_articles_page(self, event_uris, page, count):
+        return self._cached_uris(
+            'events_articles_page',
+            event_uris,
+            lambda missing_uris: self.client.events_articles_page(missing_uris, page, count),
+            page,
+            count)
+
+    def log_stats(self):
+        lookups = self.hits + self.misses
+        logging.info("ER cache hits: %d of %d lookups (%.1f%%), %d cached responses" % (
+            self.hits, lookups, 100.0 * self.hits / max(lookups, 1), self.entry_n))
+
+    def close(self):
+        self.log_stats()
+        with self.lock:
+            self.conn.close()
+        self.client.close()
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket rate limiter: allows rate acquisitions per second on average
+    and bursts of up to burst acquisitions.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, wait until one is available if needed."""
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # reserve the token even if it is not there yet, so waiting threads are served in order
+            wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0
+            self.tokens -= 1
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RateLimitedERClient(object):
+    """
+    Client passing lookups to another client with at most max_in_flight of them running at once
+    and at most rate of them started per second on average (no rate limit if rate is 0).
+    Put it under a CachingERClient so only cache misses count against the limits.
+    The lookups passed on (round trips to ER) are counted in requests and logged on close.
+    """
+
+    def __init__(self, client, max_in_flight=MAX_IN_FLIGHT, rate=REQUEST_RATE, burst=REQUEST_BURST):
+        self.client = client
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.requests = Counter()
+        self.lock = threading.Lock()
+
+    def _call(self, lookup, *args):
+        with self.lock:
+            self.requests[lookup.__name__] += 1
+        with self.in_flight:
+            if self.bucket is not None:
+                self.bucket.acquire()
+            return lookup(*args)
+
+    def suggest_concepts(self, keyword):
+        return self._call(self.client.suggest_concepts, keyword)
+
+    def concept_info(self, concept_uris):
+        return self._call(self.client.concept_info, concept_uris)
+
+    def keyword_events(self, keyword, max_events):
+        return self._call(self.client.keyword_events, keyword, max_events)
+
+    def concept_events(self, concept_uri, max_events):
+        return self._call(self.client.concept_events, concept_uri, max_events)
+
+    def events_articles_page(self, event_uris, page, count):
+        return self._call(self.client.events_articles_page, event_uris, page, count)
+
+    def log_stats(self):
+        logging.info("ER requests: %d (%s)" % (
+            sum(self.requests.values()),
+            ', '.join('%s: %d' % (lookup, n) for lookup, n in sorted(self.requests.items()))))
+
+    def close(self):
+        self.log_stats()
+        self.client.close()
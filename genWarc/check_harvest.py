@@ -0,0 +1,204 @@
+"""
+Checks of the WARC harvester (per-host politeness, connection reuse and the WARC record format)
+against two local HTTP/1.1 servers, so they run without network access:
+
+    python check_harvest.py
+"""
+import os
+import glob
+import time
+import zlib
+import shutil
+import logging
+import tempfile
+import threading
+import BaseHTTPServer
+from SocketServer import ThreadingMixIn
+
+from harvest import harvest
+
+WAIT = 0.4
+# body of a chunked response, sent in chunks of 100 bytes
+CHUNKED_BODY = ''.join('chunk %d\n' % i for i in range(500))
+
+
+class LocalServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), LocalHandler)
+        # (path, time, client port) of each request
+        self.requests = []
+        self.lock = threading.Lock()
+        self.other = None
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+
+class LocalHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    /page/*: a page with Content-Length, /chunked: a chunked page, /close: a page closing the connection,
+    /short: a response cut short of its Content-Length, /redir: a redirect to /page/r of the other server.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append((self.path, time.time(), self.client_address[1]))
+        if self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(CHUNKED_BODY), 100):
+                chunk = CHUNKED_BODY[i:i + 100]
+                self.wfile.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write('0\r\n\r\n')
+        elif self.path == '/short':
+            self.send_response(200)
+            self.send_header('Content-Length', '100')
+            self.end_headers()
+            self.wfile.write('only 10 b.')
+            self.close_connection = True
+        elif self.path == '/redir':
+            self.send_response(302)
+            self.send_header('Location', self.server.other.base_url + '/page/r')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            body = 'page %s' % self.path
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            if self.path == '/close':
+                self.send_header('Connection', 'close')
+                self.close_connection = True
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def read_records(fnm):
+    """Read the records of a WARC file, checking that each is a gzip member of its own; return [(headers, block)]."""
+    with open(fnm, 'rb') as infile:
+        data = infile.read()
+    records = []
+    while data:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        record = decompressor.decompress(data)
+        data = decompressor.unused_data
+        head, rest = record.split('\r\n\r\n', 1)
+        lines = head.split('\r\n')
+        assert lines[0] == 'WARC/1.0', lines[0]
+        headers = dict(line.split(': ', 1) for line in lines[1:])
+        length = int(headers['Content-Length'])
+        assert rest[length:] == '\r\n\r\n', "record block is not %d bytes long" % length
+        records.append((headers, rest[:length]))
+    return records
+
+
+def read_warc_dir(out_dir):
+    """Read the records of all WARC files in out_dir, return {file name: [(headers, block)]}."""
+    return dict((os.path.basename(fnm), read_records(fnm)) for fnm in glob.glob(os.path.join(out_dir, '*.warc.gz')))
+
+
+def check_politeness(servers, out_dir):
+    server_a, server_b = servers
+    urls = [server.base_url + '/page/%d' % i for server in servers for i in range(3)]
+    stats = harvest(urls + urls[:1], out_dir, 'polite', workers = 2, wait = WAIT, random_wait = False, timeout = 5)
+    assert (stats['fetched'], stats['skipped'], stats['failed']) == (6, 1, 0), stats
+    for server in servers:
+        times = [t for _, t, _ in server.requests]
+        assert len(times) == 3, server.requests
+        # requests to the same host are spaced by the wait
+        gaps = [t2 - t1 for t1, t2 in zip(times, times[1:])]
+        assert min(gaps) >= WAIT * 0.9, gaps
+        # and all sent over a single kept-alive connection
+        assert len(set(port for _, _, port in server.requests)) == 1, server.requests
+    # while the hosts are fetched in parallel
+    assert abs(server_a.requests[0][1] - server_b.requests[0][1]) < WAIT / 2
+    assert abs(server_a.requests[-1][1] - server_b.requests[-1][1]) < WAIT / 2
+
+
+def check_records(servers, out_dir):
+    server_a, server_b = servers
+    urls = [server_a.base_url + path for path in ['/page/1', '/chunked', '/close', '/short', '/redir', '/page/2']]
+    stats = harvest(urls + ['ftp://example.com/file'], out_dir, 'records', workers = 2, wait = 0, timeout = 5)
+    assert (stats['fetched'], stats['redirects'], stats['failed'], stats['skipped']) == (6, 1, 1, 1), stats
+    # the pages after /close and /short are fetched over new connections
+    ports = [port for _, _, port in server_a.requests]
+    assert len(set(ports)) == 3, server_a.requests
+
+    requests = {}
+    responses = {}
+    answered = set()
+    for fnm, records in read_warc_dir(out_dir).items():
+        assert records[0][0]['WARC-Type'] == 'warcinfo' and records[0][0]['WARC-Filename'] == fnm, records[0]
+        for headers, block in records[1:]:
+            if headers['WARC-Type'] == 'request':
+                assert block.startswith('GET ') and block.endswith('\r\n\r\n'), block
+                requests[headers['WARC-Record-ID']] = headers['WARC-Target-URI']
+            else:
+                assert headers['WARC-Type'] == 'response', headers
+                assert headers['Content-Type'] == 'application/http; msgtype=response', headers
+                responses[headers['WARC-Target-URI']] = (headers, block)
+                answered.add(headers['WARC-Concurrent-To'])
+
+    # every response answers a request of its url, the cut short response is dropped with its request
+    fetched = [url for url in urls if url != server_a.base_url + '/short'] + [server_b.base_url + '/page/r']
+    assert sorted(responses) == sorted(fetched), sorted(responses)
+    for url, (headers, block) in responses.items():
+        assert requests[headers['WARC-Concurrent-To']] == url, (url, headers)
+    # and every request has its response
+    assert set(requests) == answered, sorted(requests[record_id] for record_id in set(requests) - answered)
+
+    # the chunked body is recorded decoded, with its length instead of the transfer encoding
+    head, body = responses[server_a.base_url + '/chunked'][1].split('\r\n\r\n', 1)
+    assert body == CHUNKED_BODY
+    assert 'Content-Length: %d' % len(CHUNKED_BODY) in head.split('\r\n'), head
+    assert 'transfer-encoding' not in head.lower(), head
+    head, body = responses[server_a.base_url + '/page/1'][1].split('\r\n\r\n', 1)
+    assert head.startswith('HTTP/1.1 200 ') and body == 'page /page/1', (head, body)
+
+
+def check_rotation(servers, out_dir):
+    urls = [servers[0].base_url + '/page/%d' % i for i in range(10)]
+    harvest(urls, out_dir, 'rotation', workers = 1, wait = 0, timeout = 5, max_warc_size = 1000)
+    warcs = read_warc_dir(out_dir)
+    assert len(warcs) > 1, sorted(warcs)
+    # each part starts with its own warcinfo record and holds complete request/response pairs
+    for fnm, records in warcs.items():
+        assert [headers['WARC-Type'] for headers, _ in records[1:]] == ['request', 'response'] * ((len(records) - 1) / 2), fnm
+        assert records[0][0]['WARC-Type'] == 'warcinfo', fnm
+    assert sum(len(records) - 1 for records in warcs.values()) == 20
+
+
+def main():
+    logging.basicConfig(format = '%(asctime)s| %(message)s', datefmt = '%H:%M:%S', level = logging.ERROR)
+    tmp_dir = tempfile.mkdtemp(prefix = 'check_harvest_')
+    servers = [LocalServer(), LocalServer()]
+    servers[0].other, servers[1].other = servers[1], servers[0]
+    for server in servers:
+        thread = threading.Thread(target = server.serve_forever)
+        thread.daemon = True
+        thread.start()
+    try:
+        for check in [check_politeness, check_records, check_rotation]:
+            for server in servers:
+                del server.requests[:]
+            out_dir = os.path.join(tmp_dir, check.__name__)
+            check(servers, out_dir)
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(tmp_dir)
+    print "all harvest checks passed"
+
+
+if __name__ == '__main__':
+    main()
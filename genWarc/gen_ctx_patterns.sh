@@ -8,39 +8,22 @@ search_param_file=$2
 numEvents=$3
 
 rm -f er_search_results.json.tmp
-rm -f webpage_list.tmp
+rm -f all_webpages.tmp
 mkdir -p logs
 
-#flag to build a filename for links of returned pages
-counter=0
+#perform search queries on ER for all learned patterns in a single run (one json line per pattern)
+python ../categorizER/categorizER.py --apiKey $apiKey --get_articles -e $numEvents -r 40 --batch "$search_param_file" er_search_results.json.tmp
 
-#for all learned patterns
-while read line; do
+#parse the urls from the search results of all learned patterns into a single list for the harvest,
+#the webpages of each pattern are also logged into logs/webpage_list.N
+if [ -f er_search_results.json.tmp ]; then
+    python uriExtractor.py er_search_results.json.tmp all_webpages.tmp logs
+fi
+#harvest nothing if no results were produced
+touch all_webpages.tmp
 
-    search_param=$line
-
-    #perform search query on ER
-    python ../categorizER/categorizER.py --apiKey $apiKey --get_articles -e $numEvents -r 40 "$search_param" er_search_results.json.tmp
-
-    #parse the url from the search results
-    python uriExtractor.py er_search_results.json.tmp webpage_list.tmp
-
-    #for all webpages extracted from ER
-    while read line; do
-
-        #send control message
-        echo generating WARC for $line based on search param $ctx_pattern
-
-        #generate a WARC file of the webpage
-        ./genWarc $line $counter
-
-        let counter++
-
-    done < webpage_list.tmp
-
-    #create log file
-    mv webpage_list.tmp logs/webpage_list.$counter
-
-done < $search_param_file
+#generate the WARC files of all webpages, fetching different hosts in parallel
+#and waiting 10 seconds between requests to the same host
+python harvest.py all_webpages.tmp --out_dir warc --prefix file --wait 10
 
 tar cfv logs.tar.gz logs
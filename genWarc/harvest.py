@@ -0,0 +1,434 @@
+"""
+Harvest web pages into gzipped WARC files.
+
+Pages of different hosts are fetched in parallel (at most --workers at once), while the requests
+to each host are spaced by --wait seconds (randomized like wget --random-wait) and reuse the
+host's keep-alive connection. Each worker streams its request and response records straight
+into its own WARC file, [out_dir]/[prefix]-[worker]-[part].warc.gz (a gzip member per record).
+python check_harvest.py checks the politeness and the WARC records against local servers.
+"""
+import os
+import sys
+import time
+import uuid
+import heapq
+import zlib
+import random
+import socket
+import httplib
+import logging
+import argparse
+import tempfile
+import threading
+import urlparse
+from itertools import chain
+from collections import deque, Counter
+
+# seconds between requests to the same host (as wget --wait in genWarc.sh)
+WAIT = 10
+# number of pages fetched at once
+WORKERS = 8
+# socket timeout in seconds
+TIMEOUT = 30
+MAX_REDIRECTS = 5
+# a new WARC file is started when the current one grows larger (in bytes)
+MAX_WARC_SIZE = 1 << 30
+USER_AGENT = 'Mozilla/5.0 (compatible; er-nell-harvest/1.0)'
+# size of the chunks responses are read and compressed in
+CHUNK_SIZE = 64 * 1024
+# responses of unknown length are kept in memory up to this size, then spooled to disk
+SPOOL_SIZE = 4 << 20
+COMPRESS_LEVEL = 6
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+def warc_date():
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+
+def host_key(url):
+    """Return the (scheme, host:port) requests to the url are sent to, None for urls that can not be fetched."""
+    parts = urlparse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.netloc:
+        return None
+    return parts.scheme, parts.netloc.lower()
+
+
+class WarcWriter(object):
+    """
+    Write WARC records into [out_dir]/[name]-[part].warc.gz, starting a new part when a file exceeds max_size
+(only before records that may start one, so a request and its response stay in the same file).
+    Each record is compressed into its own gzip member as it is written; a record that fails halfway
+    is truncated from the file, so the file only holds complete records.
+    """
+    def __init__(self, out_dir, name, max_size = MAX_WARC_SIZE):
+        self.out_dir = out_dir
+        self.name = name
+        self.max_size = max_size
+        self.part = 0
+        self.outfile = None
+        self.record_n = 0
+        # file offset of the last record written
+        self.last_start = None
+
+    def _open(self):
+        fnm = os.path.join(self.out_dir, '%s-%d.warc.gz' % (self.name, self.part))
+        self.part += 1
+        self.outfile = open(fnm, 'wb')
+        fields = 'software: er-nell genWarc/harvest.py\r\nformat: WARC File Format 1.0\r\n'
+        self.write_record(
+            [('WARC-Type', 'warcinfo'),
+             ('WARC-Filename', os.path.basename(fnm)),
+             ('Content-Type', 'application/warc-fields')],
+            [fields],
+            len(fields))
+
+    def write_record(self, headers, block, length, rotate = True):
+        """
+        Write a record with the given headers (list of (name, value)) and a block of length bytes given as a chunk iterable.
+        A new part is only started before the record if rotate is set.
+        """
+        if self.outfile is None or (rotate and self.outfile.tell() >= self.max_size):
+            self.close()
+            self._open()
+        record_id = '<urn:uuid:%s>' % uuid.uuid4()
+        head = ['WARC/1.0', 'WARC-Record-ID: ' + record_id, 'WARC-Date: ' + warc_date()]
+        head.extend('%s: %s' % header for header in headers)
+        head.append('Content-Length: %d' % length)
+        start = self.outfile.tell()
+        try:
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.outfile.write(compressor.compress('\r\n'.join(head) + '\r\n\r\n'))
+            written = 0
+            for chunk in block:
+                written += len(chunk)
+                self.outfile.write(compressor.compress(chunk))
+            if written != length:
+                raise IOError('record block has %d bytes instead of %d' % (written, length))
+            self.outfile.write(compressor.compress('\r\n\r\n'))
+            self.outfile.write(compressor.flush())
+        except:
+            self.outfile.seek(start)
+            self.outfile.truncate()
+            raise
+        self.last_start = start
+        self.record_n += 1
+        return record_id
+
+    def remove_last_record(self):
+        """Truncate the last record written from the file (e.g. a request whose response could not be recorded)."""
+        self.outfile.seek(self.last_start)
+        self.outfile.truncate()
+        self.last_start = None
+        self.record_n -= 1
+
+    def close(self):
+        if self.outfile is not None:
+            self.outfile.close()
+            self.outfile = None
+
+
+class HostQueues(object):
+    """
+    Per-host queues of urls that hand out one url at a time to the workers.
+    A host is fetched by a single worker at a time and only after its politeness delay has passed
+    since its previous request; its connection is kept for the next request while it has queued urls.
+    """
+    def __init__(self, wait = WAIT, random_wait = True):
+        self.wait = wait
+        self.random_wait = random_wait
+        self.queues = {}
+        self.next_time = {}
+        self.connections = {}
+        # (time, host) of the hosts that have queued urls and are not being fetched
+        self.ready = []
+        self.busy = set()
+        self.seen = set()
+        # urls queued or being fetched
+        self.pending = 0
+        self.cond = threading.Condition()
+
+    def put(self, url, redirects_left = MAX_REDIRECTS):
+        """Queue the url unless it was queued before; return if it was queued."""
+        host = host_key(url)
+        with self.cond:
+            if host is None or url in self.seen:
+                return False
+            self.seen.add(url)
+            queue = self.queues.setdefault(host, deque())
+            if not queue and host not in self.busy:
+                heapq.heappush(self.ready, (self.next_time.get(host, 0), host))
+            queue.append((url, redirects_left))
+            self.pending += 1
+            self.cond.notify_all()
+            return True
+
+    def get(self):
+        """Wait for a url whose host may be fetched, return (host, url, redirects_left, connection) or None when all urls are done."""
+        with self.cond:
+            while True:
+                if self.pending == 0:
+                    return None
+                now = time.time()
+                if self.ready and self.ready[0][0] <= now:
+                    _, host = heapq.heappop(self.ready)
+                    self.busy.add(host)
+                    url, redirects_left = self.queues[host].popleft()
+                    return host, url, redirects_left, self.connections.pop(host, None)
+                self.cond.wait(self.ready[0][0] - now if self.ready else None)
+
+    def done(self, host, connection):
+        """Return the host after fetching a url from it, with its connection (None if it is closed)."""
+        with self.cond:
+            self.pending -= 1
+            self.busy.remove(host)
+            delay = self.wait * random.uniform(0.5, 1.5) if self.random_wait else self.wait
+            self.next_time[host] = time.time() + delay
+            if self.queues[host]:
+                heapq.heappush(self.ready, (self.next_time[host], host))
+                if connection is not None:
+                    self.connections[host] = connection
+            else:
+                del self.queues[host]
+                if connection is not None:
+                    connection.close()
+            self.cond.notify_all()
+
+
+def connect(host, timeout = TIMEOUT):
+    scheme, netloc = host
+    if scheme == 'https':
+        return httplib.HTTPSConnection(netloc, timeout = timeout)
+    return httplib.HTTPConnection(netloc, timeout = timeout)
+
+
+def send_request(connection, url, user_agent = USER_AGENT):
+    """Send a GET request for the url and return its raw bytes (for the request record)."""
+    parts = urlparse.urlsplit(url)
+    path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+    request = [
+        'GET %s HTTP/1.1' % path,
+        'Host: %s' % parts.netloc,
+        'User-Agent: %s' % user_agent,
+        'Accept: */*',
+        'Accept-Encoding: identity',
+        'Connection: keep-alive']
+    connection.putrequest('GET', path, skip_host = True, skip_accept_encoding = True)
+    for line in request[1:]:
+        name, value = line.split(': ', 1)
+        connection.putheader(name, value)
+    connection.endheaders()
+    return '\r\n'.join(request) + '\r\n\r\n'
+
+
+def iter_body(response, size = None):
+    """Read the response body in chunks (exactly size bytes if given)."""
+    while size is None or size > 0:
+        chunk = response.read(CHUNK_SIZE if size is None else min(CHUNK_SIZE, size))
+        if not chunk:
+            if size:
+                raise httplib.IncompleteRead('', size)
+            break
+        if size is not None:
+            size -= len(chunk)
+        yield chunk
+
+
+def response_head(response, body_length = None):
+    """
+    Rebuild the status line and headers of the response. The body is recorded decoded from
+    the chunked transfer encoding, so Transfer-Encoding is replaced with its Content-Length.
+    """
+    lines = ['HTTP/%s %d %s\r\n' % ('1.1' if response.version == 11 else '1.0', response.status, response.reason)]
+    for line in response.msg.headers:
+        if line.lower().startswith('transfer-encoding:'):
+            continue
+        if body_length is not None and line.lower().startswith('content-length:'):
+            continue
+        lines.append(line if line.endswith('\n') else line + '\r\n')
+    if body_length is not None:
+        lines.append('Content-Length: %d\r\n' % body_length)
+    lines.append('\r\n')
+    return ''.join(lines)
+
+
+def write_response(writer, url, response, request_record_id):
+    """Stream the response into a response record (bodies of unknown length are spooled first), return the body length."""
+    headers = [
+        ('WARC-Type', 'response'),
+        ('WARC-Target-URI', url),
+        ('WARC-Concurrent-To', request_record_id),
+        ('Content-Type', 'application/http; msgtype=response')]
+    if response.length is not None and not response.chunked:
+        body_length = response.length
+        head = response_head(response)
+        writer.write_record(headers, chain([head], iter_body(response, body_length)), len(head) + body_length, rotate = False)
+        return body_length
+    with tempfile.SpooledTemporaryFile(SPOOL_SIZE) as spool:
+        body_length = 0
+        for chunk in iter_body(response):
+            spool.write(chunk)
+            body_length += len(chunk)
+        head = response_head(response, body_length)
+        spool.seek(0)
+        writer.write_record(headers, chain([head], iter(lambda: spool.read(CHUNK_SIZE), '')), len(head) + body_length, rotate = False)
+    return body_length
+
+
+def fetch(writer, url, host, connection, timeout = TIMEOUT, user_agent = USER_AGENT):
+    """
+    Fetch the url and write its request and response records. A kept-alive connection that the host
+    has closed in the meantime is replaced once. Return (response, connection), the connection is None
+    if it can not be reused.
+    """
+    reused = connection is not None
+    while True:
+        if connection is None:
+            connection = connect(host, timeout)
+        try:
+            request = send_request(connection, url, user_agent)
+            response = connection.getresponse()
+            break
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            connection = None
+            if not reused:
+                raise
+            reused = False
+    try:
+        request_record_id = writer.write_record(
+            [('WARC-Type', 'request'),
+             ('WARC-Target-URI', url),
+             ('Content-Type', 'application/http; msgtype=request')],
+            [request],
+            len(request))
+        try:
+            write_response(writer, url, response, request_record_id)
+        except:
+            # keep only complete request/response pairs in the WARC
+            writer.remove_last_record()
+            raise
+    except:
+        connection.close()
+        raise
+    # the body is read, closing the response frees the connection for the next request
+    response.close()
+    if response.will_close:
+        connection.close()
+        connection = None
+    return response, connection
+
+
+def harvest_worker(queues, writer, stats, timeout, user_agent):
+    while True:
+        item = queues.get()
+        if item is None:
+            break
+        host, url, redirects_left, connection = item
+        try:
+            response, connection = fetch(writer, url, host, connection, timeout, user_agent)
+            stats['fetched'] += 1
+            logging.info("%d %s" % (response.status, url))
+            location = response.getheader('location')
+            if response.status in REDIRECT_STATUSES and location:
+                # redirect targets are queued on their host, so politeness applies to them as well
+                if redirects_left <= 0:
+                    logging.warning("too many redirects: %s" % url)
+                elif queues.put(urlparse.urljoin(url, location.strip()), redirects_left - 1):
+                    stats['redirects'] += 1
+        except Exception as e:
+            stats['failed'] += 1
+            logging.warning("failed: %s (%s: %s)" % (url, type(e).__name__, e))
+            connection = None
+        finally:
+            queues.done(host, connection)
+
+
+def harvest(
+        urls,
+        out_dir = 'warc',
+        prefix = 'harvest',
+        workers = WORKERS,
+        wait = WAIT,
+        random_wait = True,
+        timeout = TIMEOUT,
+        max_redirects = MAX_REDIRECTS,
+        max_warc_size = MAX_WARC_SIZE,
+        user_agent = USER_AGENT):
+    """Fetch the urls into WARC files in out_dir, return the counts of fetched, failed and skipped urls and followed redirects."""
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    queues = HostQueues(wait, random_wait)
+    skipped_n = 0
+    for url in urls:
+        if not queues.put(url, max_redirects):
+            skipped_n += 1
+    # every worker writes its own WARC file and counts into its own stats
+    writers = [WarcWriter(out_dir, '%s-%d' % (prefix, i), max_warc_size) for i in range(workers)]
+    worker_stats = [Counter() for writer in writers]
+    threads = [
+        threading.Thread(target = harvest_worker, args = (queues, writer, stats, timeout, user_agent))
+        for writer, stats in zip(writers, worker_stats)]
+    try:
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        # join with a timeout, so the main thread can still be interrupted
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+    finally:
+        for writer in writers:
+            writer.close()
+    stats = sum(worker_stats, Counter())
+    stats['skipped'] = skipped_n
+    return stats
+
+
+def iter_urls(infile):
+    """Read urls from a file, one per line (empty lines are skipped)."""
+    for line in infile:
+        url = line.strip()
+        if url:
+            yield url
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Fetch web pages into gzipped WARC files, in parallel across hosts and politely per host.')
+    parser.add_argument('url_file', help = 'file with one url per line (- for stdin)')
+    parser.add_argument('--out_dir', default = 'warc', help = 'directory of the WARC files (default: %(default)s)')
+    parser.add_argument('--prefix', default = 'harvest', help = 'WARC file name prefix; files are named [prefix]-[worker]-[part].warc.gz (default: %(default)s)')
+    parser.add_argument('--workers', type = int, default = WORKERS, help = 'maximum number of pages fetched at once (default: %(default)s)')
+    parser.add_argument('--wait', type = float, default = WAIT, help = 'seconds between requests to the same host (default: %(default)s)')
+    parser.add_argument('--no_random_wait', action = 'store_true', default = False, help = 'always wait exactly --wait seconds (default: between 0.5 and 1.5 times --wait)')
+    parser.add_argument('--timeout', type = float, default = TIMEOUT, help = 'socket timeout in seconds (default: %(default)s)')
+    parser.add_argument('--max_redirects', type = int, default = MAX_REDIRECTS, help = 'maximum number of redirects followed per url (default: %(default)s)')
+    parser.add_argument('--max_warc_size', type = int, default = MAX_WARC_SIZE, help = 'bytes after which a new WARC file is started (default: %(default)s)')
+    parser.add_argument('--user_agent', default = USER_AGENT, help = 'User-Agent header of the requests (default: %(default)s)')
+    args = parser.parse_args()
+
+    logging.basicConfig(format = '%(asctime)s| %(message)s', datefmt = '%H:%M:%S', level = logging.INFO)
+
+    infile = sys.stdin if args.url_file == '-' else open(args.url_file)
+    try:
+        start = time.time()
+        stats = harvest(
+            iter_urls(infile),
+            args.out_dir,
+            args.prefix,
+            args.workers,
+            args.wait,
+            not args.no_random_wait,
+            args.timeout,
+            args.max_redirects,
+            args.max_warc_size,
+            args.user_agent)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+    logging.info("fetched %d pages (%d redirects followed, %d failed, %d skipped) in %.1fs" % (
+        stats['fetched'], stats['redirects'], stats['failed'], stats['skipped'], time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
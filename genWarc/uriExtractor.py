@@ -1,18 +1,52 @@
+import os
 import json
 import sys
 import pprint
 
 json_file=sys.argv[1]
 output_file=sys.argv[2]
+#optional directory for a list of the webpages of each result (log_dir/webpage_list.N)
+log_dir=sys.argv[3] if len(sys.argv) > 3 else None
+
+
+def iter_results(data_file):
+    """Read categorizER results: a single json object or one object per line (batch mode)."""
+    content = data_file.read()
+    try:
+        yield json.loads(content)
+    except ValueError:
+        for line in content.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_related_events(result):
+    """Events are listed either for the keyword or for each suggested concept."""
+    for re in result.get('related_events', []):
+        yield re
+    for cs in result.get('concept_suggestions', []):
+        for re in cs.get('related_events', []):
+            yield re
+
 
 with open(json_file) as data_file:
-    data = json.load(data_file)
+    results = list(iter_results(data_file))
 
 output = open(output_file, 'w')
 
-for re in data['related_events']:
-    for ar in re['articles']:
-        output.write(ar + '\n')
+#number of webpages collected so far, names the log file of each result
+counter = 0
+for result in results:
+    webpages = [ar.encode('utf8') for re in iter_related_events(result) for ar in re.get('articles', [])]
+    for webpage in webpages:
+        output.write(webpage + '\n')
+    counter += len(webpages)
 
-output.close()
+    if log_dir is not None:
+        #send control message
+        print 'collected %d webpages based on search param %s' % (len(webpages), result.get('keyword', u'').encode('utf8'))
+        #create log file
+        with open(os.path.join(log_dir, 'webpage_list.%d' % counter), 'w') as log_file:
+            log_file.writelines(webpage + '\n' for webpage in webpages)
 
+output.close()
@@ -0,0 +1,84 @@
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.Method;
+import java.security.Permission;
+import java.util.jar.JarFile;
+
+/**
+ * Runs zenodotus for many relations in a single JVM.
+ * Reads relation names from stdin (one per line) and answers each with a line on stdout
+ * holding a JSON list of the lines zenodotus printed for it.
+ *
+ * Build: javac ZenodotusBatch.java
+ * Run:   java -cp .:zenodotus.jar ZenodotusBatch zenodotus.jar
+ */
+public class ZenodotusBatch {
+
+	static class ExitException extends SecurityException {
+		ExitException(int status) {
+			super("exit " + status);
+		}
+	}
+
+	public static void main(String[] args) throws Exception {
+		String mainClass = new JarFile(args[0]).getManifest().getMainAttributes().getValue("Main-Class");
+		Method zenodotusMain = Class.forName(mainClass).getMethod("main", String[].class);
+		PrintStream out = System.out;
+
+		// keep zenodotus from exiting the JVM; without a security manager (newer JVMs)
+		// an exit just ends the helper and the caller starts a new one
+		try {
+			System.setSecurityManager(new SecurityManager() {
+				public void checkExit(int status) {
+					throw new ExitException(status);
+				}
+				public void checkPermission(Permission perm) {
+				}
+			});
+		} catch (UnsupportedOperationException e) {
+		}
+
+		BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+		String relation;
+		while ((relation = in.readLine()) != null) {
+			ByteArrayOutputStream buffer = new ByteArrayOutputStream();
+			System.setOut(new PrintStream(buffer, true, "UTF-8"));
+			try {
+				zenodotusMain.invoke(null, (Object) new String[] {"-gr", relation.trim()});
+			} catch (Throwable e) {
+				// failures show up as malformed output on the python side
+			} finally {
+				System.out.flush();
+				System.setOut(out);
+			}
+			out.println(toJsonList(buffer.toString("UTF-8")));
+			out.flush();
+		}
+	}
+
+	static String toJsonList(String text) {
+		StringBuilder json = new StringBuilder("[");
+		// split like python's str.splitlines: keep empty lines, but a final line break does not start another line
+		String[] lines = text.split("\r\n|\r|\n", -1);
+		int lineCount = lines[lines.length - 1].isEmpty() ? lines.length - 1 : lines.length;
+		for (int i = 0; i < lineCount; i++) {
+			if (i > 0) {
+				json.append(", ");
+			}
+			json.append('"');
+			for (char c : lines[i].toCharArray()) {
+				if (c == '"' || c == '\\') {
+					json.append('\\').append(c);
+				} else if (c < 0x20) {
+					json.append(String.format("\\u%04x", (int) c));
+				} else {
+					json.append(c);
+				}
+			}
+			json.append('"');
+		}
+		return json.append("]").toString();
+	}
+}
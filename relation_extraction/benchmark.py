@@ -0,0 +1,159 @@
+"""
+Small benchmarks for the NELL relation extraction code.
+Run them from this directory, e.g.: python benchmark.py triples
+"""
+import time
+import random
+import argparse
+from collections import Counter
+
+from nell_rel_extract import get_context_between, get_wiki_triples, tokenize_context, normalize_key, normalize_tokens, ContextNormalizer, PatternMatcher, CachedPatternMatcher
+
+
+def make_synthetic_annotations(word_n, mention_n, seed = 0):
+	"""Build Wikifier output of a synthetic article with the given number of (possibly overlapping) mentions."""
+	rnd = random.Random(seed)
+	vocabulary = [u'the', u'company', u'said', u'of', u'shares', u'in', u'a', u'deal', u'with', u'reported']
+	words = [rnd.choice(vocabulary) for _ in xrange(word_n)]
+	spaces = [u''] + [rnd.choice([u' ', u' ', u', ']) for _ in xrange(word_n - 1)] + [u'.']
+	annotations = []
+	for mention_i in xrange(mention_n):
+		w_from = rnd.randrange(word_n)
+		annotations.append({
+			'url': u'http://en.wikipedia.org/wiki/Concept_%d' % rnd.randrange(mention_n // 4 + 1),
+			'pageRank': rnd.random() / 100,
+			'support': [{'wFrom': w_from, 'wTo': min(w_from + rnd.randint(0, 2), word_n - 1)}]})
+	return {'words': words, 'spaces': spaces, 'annotations': annotations}
+
+
+def legacy_get_wiki_triples(wikifier_annotations, min_pRank, context_size):
+	"""The original pairing: sorts all mentions and copies the tail of the mention list for every mention."""
+	annot_mentions = []
+	for annotation in wikifier_annotations["annotations"]:
+		for mention in annotation["support"]:
+			annot_mentions.append(
+				((mention["wFrom"], mention["wTo"]),
+				annotation["url"]))
+	annot_mentions.sort()
+
+	triples = Counter()
+	for m1_i, mention1 in enumerate(annot_mentions):
+		for mention2 in annot_mentions[m1_i+1:]:
+			mention_dist = mention2[0][0] - mention1[0][1]
+			if mention_dist > context_size + 1:
+				break
+			if mention_dist > 1:
+				context = get_context_between(
+					mention1[0][1],
+					mention2[0][0],
+					wikifier_annotations)
+				triples[(mention1[1], context, mention2[1])] += 1
+
+	return triples
+
+
+def best_time(func, repeat):
+	"""Return the result and the best wall time of repeated calls of func."""
+	times = []
+	for _ in xrange(repeat):
+		start = time.time()
+		result = func()
+		times.append(time.time() - start)
+	return result, min(times)
+
+
+def bench_triples(args):
+	"""Compare the original and the sliding window mention pairing on increasingly annotated articles."""
+	print "%8s %9s %12s %12s %9s %10s" % ('words', 'mentions', 'legacy s', 'window s', 'speedup', 'identical')
+	for mention_n in args.mentions:
+		annotations = make_synthetic_annotations(args.words, mention_n)
+		legacy_triples, legacy_time = best_time(
+			lambda: legacy_get_wiki_triples(annotations, 0, args.context_size), args.repeat)
+		window_triples, window_time = best_time(
+			lambda: get_wiki_triples(annotations, 0, args.context_size), args.repeat)
+		print "%8d %9d %12.4f %12.4f %8.1fx %10s" % (
+			args.words,
+			mention_n,
+			legacy_time,
+			window_time,
+			legacy_time / window_time,
+			legacy_triples == window_triples)
+
+
+def make_synthetic_contexts(context_n, distinct_n, seed = 0):
+	"""Build contexts drawn with a skewed distribution from distinct_n distinct ones, as they repeat across news."""
+	rnd = random.Random(seed)
+	vocabulary = [u'the', u'company', u"company's", u'said', u'of', u'shares', u'in', u'a', u'deal', u'with', u'CEO', u'(', u',']
+	distinct = [
+		u' '.join(rnd.choice(vocabulary) for _ in xrange(rnd.randint(1, 5)))
+		for _ in xrange(distinct_n)]
+	return [distinct[int(distinct_n * rnd.random() ** 4)] for _ in xrange(context_n)]
+
+
+def bench_normalize(args):
+	"""Compare context tokenization and lookups (exact and matcher) with and without normalization."""
+	rnd = random.Random(1)
+	contexts = make_synthetic_contexts(args.contexts, args.distinct)
+	patterns = dict.fromkeys(rnd.sample(sorted(set(contexts)), min(args.patterns, len(set(contexts)))))
+
+	raw_matcher = PatternMatcher(patterns)
+	normalizer = ContextNormalizer(args.cache_size)
+	normalized_matcher = PatternMatcher(patterns, tokenize = normalizer)
+	normalizer.clear()
+
+	# the matcher as used by extract: whole match results cached per context
+	cached_matcher = CachedPatternMatcher(PatternMatcher(patterns, tokenize = normalize_tokens), patterns, args.cache_size)
+
+	key_normalizer = ContextNormalizer(args.cache_size, normalize_key)
+	normalized_patterns = dict.fromkeys(normalize_key(pattern) for pattern in patterns)
+
+	_, tokenize_time = best_time(lambda: [tokenize_context(context) for context in contexts], args.repeat)
+	_, normalize_time = best_time(lambda: [normalizer(context) for context in contexts], args.repeat)
+	normalizer.clear()
+	_, dict_time = best_time(lambda: [context in patterns for context in contexts], args.repeat)
+	_, normalized_dict_time = best_time(
+		lambda: [key_normalizer(context) in normalized_patterns for context in contexts], args.repeat)
+	_, raw_time = best_time(lambda: [raw_matcher.match(context) for context in contexts], args.repeat)
+	normalizer.clear()
+	_, normalized_time = best_time(lambda: [normalized_matcher.match(context) for context in contexts], args.repeat)
+	lookups = normalizer.hits + normalizer.misses
+	_, cached_time = best_time(lambda: [cached_matcher.match_relations(context) for context in contexts], args.repeat)
+
+	print "%-22s %12s %14s %10s" % ('lookup', 'time s', 'contexts/s', 'slowdown')
+	for name, lookup_time in [
+			('raw tokenize', tokenize_time),
+			('normalize (cached)', normalize_time),
+			('raw dict', dict_time),
+			('normalized dict', normalized_dict_time),
+			('raw matcher', raw_time),
+			('normalized matcher', normalized_time),
+			('cached matcher', cached_time)]:
+		print "%-22s %12.4f %14d %9.1fx" % (name, lookup_time, len(contexts) / lookup_time, lookup_time / dict_time)
+	print "cache hit rate: %.1f%% (%d cached contexts)" % (100.0 * normalizer.hits / max(lookups, 1), len(normalizer))
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	subparsers = parser.add_subparsers()
+
+	parser_triples = subparsers.add_parser('triples', help='mention pairing in get_wiki_triples on synthetic articles')
+	parser_triples.add_argument('--words', type=int, default=20000, help='number of words in the article (default: %(default)s)')
+	parser_triples.add_argument('--mentions', type=int, nargs='+', default=[1000, 5000, 20000, 50000], help='numbers of mentions (default: %(default)s)')
+	parser_triples.add_argument('--context_size', type=int, default=5, help='maximal number of words between mentions (default: %(default)s)')
+	parser_triples.add_argument('--repeat', type=int, default=3, help='number of timed runs, the best is reported (default: %(default)s)')
+	parser_triples.set_defaults(func=bench_triples)
+
+	parser_normalize = subparsers.add_parser('normalize', help='context lookup throughput with and without normalization')
+	parser_normalize.add_argument('--contexts', type=int, default=500000, help='number of contexts looked up (default: %(default)s)')
+	parser_normalize.add_argument('--distinct', type=int, default=50000, help='number of distinct contexts (default: %(default)s)')
+	parser_normalize.add_argument('--patterns', type=int, default=10000, help='number of patterns (default: %(default)s)')
+	parser_normalize.add_argument('--cache_size', type=int, default=1 << 18, help='size of the normalization cache (default: %(default)s)')
+	parser_normalize.add_argument('--repeat', type=int, default=3, help='number of timed runs, the best is reported (default: %(default)s)')
+	parser_normalize.set_defaults(func=bench_normalize)
+
+	args = parser.parse_args()
+	args.func(args)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,144 @@
+"""
+Checks of the zenodotus downloader (timeouts, retries and resuming) against fake fetchers,
+so they run without java, zenodotus or network access:
+
+	python check_download.py
+"""
+import os
+import json
+import stat
+import time
+import shutil
+import logging
+import tempfile
+
+from nell_rel_extract import ZenodotusError, run_with_timeout, download_relation, download_relations
+
+# a stand-in for zenodotus: prints the 4-line output of a relation (the json on the third line),
+# logs each call and fails for relations named "broken*"
+FAKE_ZENODOTUS = """#!/bin/sh
+echo "$2" >> "%(calls_fnm)s"
+case "$2" in
+	broken*) echo "no such relation" >&2; exit 1;;
+esac
+echo "zenodotus"
+echo "relation: $2"
+echo '{"relation_name": "'"$2"'", "metadata": {}}'
+echo "done"
+"""
+
+
+def fake_output(relation):
+	return "zenodotus\nrelation: %s\n%s\ndone\n" % (relation, json.dumps({'relation_name': relation}))
+
+
+class FlakyFetch(object):
+	"""Fake fetch failing the first fail_n calls per relation (with ZenodotusError), then returning output."""
+	def __init__(self, fail_n, output = fake_output):
+		self.fail_n = fail_n
+		self.output = output
+		self.calls = []
+	def __call__(self, relation):
+		self.calls.append(relation)
+		if self.calls.count(relation) <= self.fail_n:
+			raise ZenodotusError("fake failure")
+		return self.output(relation)
+
+
+def check_timeout():
+	start = time.time()
+	try:
+		# the child of the shell keeps the pipe open - the whole process group has to be killed
+		run_with_timeout(["sh", "-c", "sleep 30; echo late"], 0.5)
+		raise AssertionError("timeout not raised")
+	except ZenodotusError as e:
+		assert "timed out" in str(e), e
+	assert time.time() - start < 5, "timed out call was not killed"
+	assert run_with_timeout(["echo", "ok"], 5) == "ok\n"
+	try:
+		run_with_timeout(["sh", "-c", "exit 3"], 5)
+		raise AssertionError("failed call not raised")
+	except ZenodotusError as e:
+		assert "code 3" in str(e), e
+
+
+def check_retries():
+	# succeeds on the last allowed attempt
+	fetch = FlakyFetch(2)
+	line = download_relation("acquired", fetch, 2, 0)
+	assert json.loads(line)['relation_name'] == "acquired"
+	assert len(fetch.calls) == 3, fetch.calls
+	# gives up after the retries
+	fetch = FlakyFetch(3)
+	assert download_relation("acquired", fetch, 2, 0) is None
+	assert len(fetch.calls) == 3, fetch.calls
+	# malformed output is not retried
+	fetch = FlakyFetch(0, output = lambda relation: "not zenodotus output\n")
+	assert download_relation("acquired", fetch, 2, 0) is None
+	assert len(fetch.calls) == 1, fetch.calls
+
+
+def check_resume(tmp_dir):
+	calls_fnm = os.path.join(tmp_dir, "calls")
+	zenodotus = os.path.join(tmp_dir, "zenodotus.sh")
+	with open(zenodotus, "w") as outfile:
+		outfile.write(FAKE_ZENODOTUS % {'calls_fnm': calls_fnm})
+	os.chmod(zenodotus, os.stat(zenodotus).st_mode | stat.S_IEXEC)
+	output_jsonl = os.path.join(tmp_dir, "relations.jsonl")
+
+	def read_calls():
+		with open(calls_fnm) as infile:
+			calls = infile.read().split()
+		os.remove(calls_fnm)
+		return sorted(calls)
+
+	def read_relations():
+		with open(output_jsonl) as infile:
+			return sorted(json.loads(line)['relation_name'] for line in infile)
+
+	relations = ["a", "b", "c", "broken"]
+	missed = download_relations(relations, zenodotus, output_jsonl, parallelism = 2, retries = 1, backoff = 0)
+	assert missed == ["broken"], missed
+	assert read_relations() == ["a", "b", "c"]
+	# the failing relation was retried once
+	assert read_calls() == ["a", "b", "broken", "broken", "c"]
+
+	# an interrupted run leaves a partially written line behind
+	with open(output_jsonl, "a") as outfile:
+		outfile.write('{"relation_name": "d", "meta')
+	missed = download_relations(relations + ["d", "e"], zenodotus, output_jsonl, parallelism = 2, retries = 0, backoff = 0)
+	assert missed == ["broken"], missed
+	# only the relations missing from the output are downloaded again
+	assert read_calls() == ["broken", "d", "e"]
+	# and the partial line is removed, so every line parses
+	with open(output_jsonl) as infile:
+		lines = infile.read().splitlines()
+	assert '{"relation_name": "d", "meta' not in lines, lines
+	assert read_relations() == ["a", "b", "c", "d", "e"]
+
+	# a file holding only a partial line is emptied
+	with open(output_jsonl, "w") as outfile:
+		outfile.write('{"relation_name": "a", "meta')
+	download_relations(["a"], zenodotus, output_jsonl)
+	assert read_calls() == ["a"]
+	assert read_relations() == ["a"]
+
+	# without resuming the output is written from scratch
+	download_relations(["a"], zenodotus, output_jsonl, resume = False)
+	assert read_relations() == ["a"]
+
+
+def main():
+	# only report problems (nell_rel_extract sets up info logging on import)
+	logging.getLogger().setLevel(logging.WARNING)
+	tmp_dir = tempfile.mkdtemp(prefix = "check_download_")
+	try:
+		for check in [check_timeout, check_retries, lambda: check_resume(tmp_dir)]:
+			check()
+	finally:
+		shutil.rmtree(tmp_dir)
+	print "all download checks passed"
+
+
+if __name__ == '__main__':
+	main()
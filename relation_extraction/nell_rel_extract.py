@@ -1,12 +1,23 @@
+import os
+import re
 import json
+import sqlite3
 import logging
 import gzip
 import sys
+import collections
 from collections import Counter
 import pdb
+import time
+import signal
+import threading
 import subprocess
+import shlex
 import argparse
 import traceback
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from itertools import imap
 
 log_level = logging.INFO
 
@@ -18,6 +29,28 @@ logging.basicConfig(
 NELL_RELATIONS_TSV = "../../NELL_resources/relations.tsv"
 NELL_PATTERNS_DUMP = "../../NELL_resources/NELL.08m.1035.extractionPatterns.csv.gz"
 
+# extension of compiled pattern index files
+PATTERN_INDEX_EXT = ".sqlite"
+# size of the memory mapped part of a pattern index (sqlite maps at most the file size)
+PATTERN_INDEX_MMAP_SIZE = 1 << 32
+
+# default minimal pageRank of annotations and maximal number of words between two related mentions
+MIN_PAGE_RANK = 0.003
+CONTEXT_SIZE = 5
+# number of articles handed to a worker process at once
+EXTRACT_CHUNK_SIZE = 16
+# size of the NELL dump chunks handed to the parsing workers and the seconds between progress reports
+PATTERN_CHUNK_BYTES = 4 << 20
+# number of contexts whose pattern matches are cached by each extraction process
+NORMALIZE_CACHE_SIZE = 1 << 18
+PROGRESS_INTERVAL = 10
+
+# zenodotus download settings: concurrent calls, timeout (s), retries and the initial retry delay (s)
+ZENODOTUS_PARALLELISM = 8
+ZENODOTUS_TIMEOUT = 120
+ZENODOTUS_RETRIES = 2
+ZENODOTUS_BACKOFF = 1.0
+
 
 def get_NELL_rel_names(nell_relations_fnm):
 	"""Get the names of relations in NELL."""
@@ -43,45 +76,233 @@ def get_NELL_rel_names(nell_relations_fnm):
 	return sorted(rel_names)
 
 
-def download_relations(relation_names, zenodotus_path, output_jsonl):
+class ZenodotusError(Exception):
+	"""Raised when a zenodotus call fails or returns unusable output."""
+	pass
+
+
+def get_zenodotus_command(zenodotus_path, relation):
+	"""
+	Build the zenodotus call for a relation, e.g.: java -jar zenodotus.jar -gr acquired
+	Paths not ending with .jar (e.g. a stand-in script) are executed directly.
+	"""
+	if zenodotus_path.endswith(".jar"):
+		return ["java", "-jar", zenodotus_path, "-gr", relation.lower()]
+	return [zenodotus_path, "-gr", relation.lower()]
+
+
+def run_with_timeout(command, timeout):
+	"""Run the command and return its output, kill it if it does not finish in timeout seconds."""
+	# run in its own process group so the kill also reaches processes it started
+	process = subprocess.Popen(command, stdout = subprocess.PIPE, stderr = subprocess.PIPE, preexec_fn = os.setsid)
+	timer = threading.Timer(timeout, os.killpg, [process.pid, signal.SIGKILL])
+	timer.start()
+	try:
+		out, err = process.communicate()
+	finally:
+		timed_out = not timer.is_alive()
+		timer.cancel()
+	if timed_out:
+		raise ZenodotusError("timed out after %d seconds" % timeout)
+	if process.returncode != 0:
+		raise ZenodotusError("exited with code %d:\n%s" % (process.returncode, err))
+	return out
+
+
+def parse_zenodotus_output(zen_out):
+	"""Return the relation json line from zenodotus output or raise ZenodotusError if the output is malformed."""
+	zen_out = zen_out.splitlines(False)
+	# test if returned output is ok
+	if len(zen_out) != 4:
+		raise ZenodotusError("bad output:\n%s" % '\n'.join(zen_out))
+	try:
+		json.loads(zen_out[2])
+	except Exception as e:
+		raise ZenodotusError("unable to parse output: %s" % str(e))
+	return zen_out[2]
+
+
+def get_zenodotus_batch_command(zenodotus_path):
+	"""Build the command starting the zenodotus batch helper (ZenodotusBatch.java, compiled next to this file)."""
+	helper_dir = os.path.dirname(os.path.abspath(__file__))
+	return ["java", "-cp", os.pathsep.join([helper_dir, zenodotus_path]), "ZenodotusBatch", zenodotus_path]
+
+
+class ZenodotusSession(object):
+	"""
+	A long-lived zenodotus helper process, so the JVM is started once instead of for every relation.
+	The helper reads relation names from stdin and answers each with a json list of zenodotus
+	output lines on stdout. It is restarted if it dies or does not answer in timeout seconds.
+	"""
+	def __init__(self, command, timeout = ZENODOTUS_TIMEOUT):
+		self.command = command
+		self.timeout = timeout
+		self.process = None
+
+	def start(self):
+		# run in its own process group so a kill also reaches processes it started
+		self.process = subprocess.Popen(
+			self.command, stdin = subprocess.PIPE, stdout = subprocess.PIPE, preexec_fn = os.setsid)
+
+	def kill(self):
+		if self.process is None:
+			return
+		try:
+			os.killpg(self.process.pid, signal.SIGKILL)
+		except OSError:
+			pass
+		self.process.wait()
+		self.process = None
+
+	def close(self):
+		self.kill()
+
+	def query(self, relation):
+		"""Get the zenodotus output for a relation, raise ZenodotusError if the helper fails."""
+		if self.process is None or self.process.poll() is not None:
+			self.kill()
+			self.start()
+		timer = threading.Timer(self.timeout, os.killpg, [self.process.pid, signal.SIGKILL])
+		timer.start()
+		try:
+			self.process.stdin.write(relation.lower() + "\n")
+			self.process.stdin.flush()
+			line = self.process.stdout.readline()
+		except IOError:
+			line = ""
+		finally:
+			timed_out = not timer.is_alive()
+			timer.cancel()
+		if not line:
+			self.kill()
+			raise ZenodotusError("helper timed out after %d seconds" % self.timeout if timed_out else "helper died")
+		try:
+			lines = json.loads(line)
+			# rebuild the output so it splits into the same lines (empty ones included) as the helper sent
+			return u"".join(output_line + u"\n" for output_line in lines).encode('utf8')
+		except (ValueError, TypeError):
+			# the helper is out of sync with our requests, start a fresh one
+			self.kill()
+			raise ZenodotusError("unable to parse helper output: %s" % line)
+
+
+def download_relation(relation, fetch, retries, backoff):
+	"""
+	Download a single relation and return its json line (None if unsuccessful).
+	fetch(relation) returns the raw zenodotus output.
+	Failed or timed out calls are retried with exponential backoff; malformed output is not retried.
+	"""
+	for attempt in xrange(retries + 1):
+		try:
+			zen_out = fetch(relation)
+		except (ZenodotusError, OSError) as e:
+			logging.info("Zenodotus call for relation %s failed (attempt %d of %d): %s" % (relation, attempt + 1, retries + 1, e))
+			if attempt < retries:
+				time.sleep(backoff * 2 ** attempt)
+			continue
+		try:
+			return parse_zenodotus_output(zen_out)
+		except ZenodotusError as e:
+			logging.info("Zenodotus error on relation %s: %s" % (relation, e))
+			return None
+	return None
+
+
+def get_downloaded_relations(output_jsonl):
+	"""Get the (lowercased) names of relations already stored in the output jsonl file."""
+	downloaded = set([])
+	if not os.path.exists(output_jsonl):
+		return downloaded
+	with open(output_jsonl) as infile:
+		for line in infile:
+			try:
+				downloaded.add(json.loads(line)['relation_name'].lower())
+			except (ValueError, KeyError, AttributeError):
+				# skip broken (e.g. partially written) lines
+				continue
+	return downloaded
+
+
+def truncate_partial_line(fnm, block_size = 64 * 1024):
+	"""Truncate the file after its last newline, dropping a partially written last line."""
+	with open(fnm, 'rb+') as outfile:
+		outfile.seek(0, os.SEEK_END)
+		end = outfile.tell()
+		while end > 0:
+			start = max(0, end - block_size)
+			outfile.seek(start)
+			newline_i = outfile.read(end - start).rfind("\n")
+			if newline_i >= 0:
+				end = start + newline_i + 1
+				break
+			end = start
+		outfile.truncate(end)
+
+
+def download_relations(
+		relation_names,
+		zenodotus_path,
+		output_jsonl,
+		parallelism = ZENODOTUS_PARALLELISM,
+		timeout = ZENODOTUS_TIMEOUT,
+		retries = ZENODOTUS_RETRIES,
+		backoff = ZENODOTUS_BACKOFF,
+		resume = True,
+		batch_command = None):
 	"""
 	Scrape relations from the NELL website using the external tool 'zenodotus'.
 	Store results into a jsonl file.
+	Up to parallelism zenodotus calls run at the same time. When resuming,
+	relations already present in the output file are skipped and new ones are appended.
+	If batch_command is given, each thread sends its relations to its own long-lived
+	helper process started with it (see ZenodotusSession) instead of running zenodotus per relation.
 	"""
-	logging.info("Going to download data for %d relations" % len(relation_names))
+	if resume and os.path.exists(output_jsonl):
+		# drop a line left partially written by an interrupted run, so readers only see whole lines
+		truncate_partial_line(output_jsonl)
+	downloaded = get_downloaded_relations(output_jsonl) if resume else set([])
+	pending_relations = [relation for relation in relation_names if relation.lower() not in downloaded]
+	logging.info("Going to download data for %d relations (%d already downloaded)" % (
+		len(pending_relations), len(relation_names) - len(pending_relations)))
 
 	# list of relations for which the download was unsuccessful
 	missed_relations = []
 
-	# call zenodotus for each relation and store the output
-	with open(output_jsonl, 'w') as outfile:
-		for rel_i, relation in enumerate(relation_names):
-			logging.info("Downloading relation %d of %d: %s" % (rel_i, len(relation_names), relation))
-			# example call: java -jar zenodotus.jar -gr acquired
-			zen_out = subprocess.check_output(["java", "-jar", zenodotus_path, "-gr", relation.lower()])
-			zen_out = zen_out.splitlines(False)
-
-			# test if returned output is ok
-			if len(zen_out) != 4:
-				logging.info("Zenodotus error on relation %s:\n%s" % (relation, '\n'.join(zen_out)) )
-				missed_relations.append(relation)
-				continue
-
-			#assert len(zen_out) == 4, "Bad zenodotus output\n" + '\n'.join(zen_out)
-
-			try:
-				test = json.loads(zen_out[2])
-			except Exception as e:
-				logging.info("Unable to parse output for relation %s:\n%s" % (relation, str(e)))
-				#raise e
-				missed_relations.append(relation)
-				continue
-
-			outfile.write(zen_out[2] + "\n")
+	sessions = []
+	thread_data = threading.local()
+
+	def fetch(relation):
+		if batch_command is None:
+			return run_with_timeout(get_zenodotus_command(zenodotus_path, relation), timeout)
+		if not hasattr(thread_data, 'session'):
+			thread_data.session = ZenodotusSession(batch_command, timeout)
+			sessions.append(thread_data.session)
+		return thread_data.session.query(relation)
+
+	def download(relation):
+		return relation, download_relation(relation, fetch, retries, backoff)
+
+	# threads are enough - they just wait for the zenodotus processes
+	pool = ThreadPool(parallelism)
+	try:
+		with open(output_jsonl, 'a' if resume else 'w') as outfile:
+			for rel_i, (relation, rel_line) in enumerate(pool.imap_unordered(download, pending_relations)):
+				logging.info("Downloaded relation %d of %d: %s" % (rel_i + 1, len(pending_relations), relation))
+				if rel_line is None:
+					missed_relations.append(relation)
+					continue
+				outfile.write(rel_line + "\n")
+				outfile.flush()
+	finally:
+		pool.close()
+		pool.join()
+		for session in sessions:
+			session.close()
 
-	logging.info("DONE!")
+	logging.info("DONE! Downloaded %d relations, missed %d" % (
+		len(pending_relations) - len(missed_relations), len(missed_relations)))
 
-	return missed_relations
+	return sorted(missed_relations)
 
 
 
@@ -93,36 +314,137 @@ def open_maybe_gzip(fnm):
 		return open(fnm)
 
 
-def get_NELL_patterns(nell_patterns_fnm, relations):
-	"""Get extraction patterns for given relations from a NELL dump file."""
+def iter_line_chunks(fnm, chunk_bytes = PATTERN_CHUNK_BYTES, skip_header = False):
+	"""
+	Read a (optionally gzipped) file in chunks of about chunk_bytes that end at line boundaries.
+	Gzipped files are decompressed by a separate gzip process.
+	"""
+	process = None
+	if fnm.endswith(".gz"):
+		try:
+			process = subprocess.Popen(["gzip", "-dc", fnm], stdout = subprocess.PIPE, bufsize = chunk_bytes)
+			infile = process.stdout
+		except OSError:
+			logging.info("gzip not available, decompressing in process")
+			infile = gzip.open(fnm)
+	else:
+		infile = open(fnm, 'rb')
+	try:
+		if skip_header:
+			infile.readline()
+		remainder = ""
+		while True:
+			data = infile.read(chunk_bytes)
+			if not data:
+				break
+			data = remainder + data
+			line_end = data.rfind("\n") + 1
+			if line_end == 0:
+				remainder = data
+				continue
+			remainder = data[line_end:]
+			yield data[:line_end]
+		if remainder:
+			yield remainder
+		if process is not None and process.wait() != 0:
+			raise IOError("gzip failed on %s with code %d" % (fnm, process.returncode))
+	finally:
+		infile.close()
+		if process is not None and process.poll() is None:
+			process.kill()
+			process.wait()
+
+
+# pattern dump parsing settings shared with the worker processes (set before the workers are forked)
+_PATTERN_PARSING = {}
+
+
+def _parse_patterns_chunk(chunk):
+	"""Parse a chunk of NELL dump lines, return the chunk size, its line count and the (pattern, relation) pairs of selected relations."""
+	relations = _PATTERN_PARSING['relations']
+	lines = chunk.split("\n")
+	if lines[-1] == "":
+		lines.pop()
+	patterns = []
+	for line in lines:
+		# check the relation before splitting the rest of the line
+		prop_name, rest = line.split("\t", 1)
+		# collect only paterns for specified relations
+		if prop_name in relations:
+			_, pattern, _ = rest.split("\t", 2)
+			patterns.append((pattern, prop_name))
+	return len(chunk), len(lines), patterns
+
+
+def get_NELL_patterns(
+		nell_patterns_fnm,
+		relations,
+		workers = 1,
+		chunk_bytes = PATTERN_CHUNK_BYTES):
+	"""
+	Get extraction patterns for given relations from a NELL dump file.
+	The dump is read in chunks that are parsed and filtered by a pool of worker processes.
+	"""
+	# a set, so the workers check each dump line in constant time
+	_PATTERN_PARSING['relations'] = frozenset(relations)
+	logging.info("Reading relation patterns from {0}".format(nell_patterns_fnm))
+
+	# skip header line
+	chunks = iter_line_chunks(nell_patterns_fnm, chunk_bytes, skip_header = True)
 	patterns = {}
-	with open_maybe_gzip(nell_patterns_fnm) as infile:
-		logging.info("Reading relation patterns from {0}".format(nell_patterns_fnm))
-		# skip header line
-		header = infile.readline()
-		# read the pattern from each line contatining a relation - skip entities
-		for line_i, line in enumerate(infile):
-			prop_name, _, pattern, _ = line.split("\t", 3)
-			#logging.debug("Read pattern: {0} - {1}".format(prop_name, pattern))
-			if line_i % 1000 == 0:
-				print "\rProcessed {0} lines".format(line_i),
-				sys.stdout.flush()
-			# collect only paterns for specified relations
-			if prop_name in relations:
-				patterns[pattern] = prop_name
-	print
-	logging.info("Read {0} patterns".format(len(patterns)))
+	byte_n = line_n = 0
+	last_report = time.time()
+	pool = multiprocessing.Pool(workers) if workers > 1 else None
+	try:
+		# ordered, so later lines override earlier ones as when reading sequentially
+		parsed_chunks = pool.imap(_parse_patterns_chunk, chunks) if pool is not None else imap(_parse_patterns_chunk, chunks)
+		for chunk_size, chunk_lines, chunk_patterns in parsed_chunks:
+			patterns.update(chunk_patterns)
+			byte_n += chunk_size
+			line_n += chunk_lines
+			if time.time() - last_report > PROGRESS_INTERVAL:
+				logging.info("Processed {0} lines ({1} MB)".format(line_n, byte_n >> 20))
+				last_report = time.time()
+		if pool is not None:
+			pool.close()
+	except:
+		if pool is not None:
+			pool.terminate()
+		raise
+	finally:
+		if pool is not None:
+			pool.join()
+	logging.info("Read {0} patterns from {1} lines".format(len(patterns), line_n))
 	return patterns
 
 
 def get_patterns_mapping(
 		nell_relations_fnm,
 		nell_patterns_fnm,
-		mapping_fnm):
+		mapping_fnm,
+		workers = 1):
+	"""
+	Map NELL extraction patterns to relation names and store the mapping.
+	If mapping_fnm ends with PATTERN_INDEX_EXT the mapping is compiled into a pattern index, otherwise dumped as json.
+	"""
 	# get all NELL relation names
-	rel_names = get_NELL_rel_names(NELL_RELATIONS_TSV)
+	rel_names = get_NELL_rel_names(nell_relations_fnm)
 	# get all relation extraction patterns
-	patterns = get_NELL_patterns(NELL_PATTERNS_DUMP, rel_names)
+	patterns = get_NELL_patterns(nell_patterns_fnm, rel_names, workers)
+
+	if mapping_fnm.endswith(PATTERN_INDEX_EXT):
+		# link the clipped patterns to (name-only) relations
+		rels = {}
+		pattern_rels = {}
+		for pattern, rel_name in patterns.iteritems():
+			ptrn, order = split_pattern(pattern)
+			if ptrn is None:
+				continue
+			rel = rels.setdefault(rel_name, {'name': rel_name})
+			pattern_rels.setdefault(ptrn, []).append({'rel': rel, 'order': order})
+		compile_pattern_index(rels.values(), pattern_rels, mapping_fnm)
+		return
+
 	# dump the mapping into file
 	logging.info("Dumping pattern mapping into {0}".format(mapping_fnm))
 	with open(mapping_fnm, "w") as outfile:
@@ -133,7 +455,8 @@ def main_get_patterns():
 	get_patterns_mapping(
 		NELL_RELATIONS_TSV,
 		NELL_PATTERNS_DUMP,
-		"pattern_mapping.json")
+		"pattern_mapping.json",
+		multiprocessing.cpu_count())
 
 
 def plot_pageRank_histogram(article):
@@ -146,8 +469,8 @@ def plot_pageRank_histogram(article):
 	plt.show()
 
 
-# TODO: Our tokenization is not the same as NELLs: eg. Nell: "John's" -> ["John", "'s"] vs. Wikifier: "John's" -> ["John's"]
-#       find a way to consolidate this
+# NOTE: Our tokenization is not the same as NELLs: eg. Nell: "John's" -> ["John", "'s"] vs. Wikifier: "John's" -> ["John's"]
+#       contexts are therefore matched against patterns on their normalize_tokens (see ContextNormalizer)
 def get_context_between(word_i1, word_i2, annotations):
 	"""Get the context between two words."""
 	# start with the first word
@@ -158,38 +481,111 @@ def get_context_between(word_i1, word_i2, annotations):
 	return context
 
 
+def get_tokens(annotations):
+	"""
+	Interleave the Wikifier spaces and words into a single token list (spaces[0], words[0], spaces[1], ...).
+	Word i is token 2*i+1, so the context between words i1 and i2 is "".join(tokens[2*i1+3:2*i2]).
+	"""
+	words, spaces = annotations["words"], annotations["spaces"]
+	tokens = [None] * (len(words) + len(spaces))
+	tokens[0::2] = spaces
+	tokens[1::2] = words
+	return tokens
+
+
+def count_window_pairs(mentions_at, counts_at, context_size):
+	"""Count the pairs the mentions in mentions_at form with the mentions counted (per first word) in counts_at."""
+	pair_n = 0
+	for mentions in mentions_at.itervalues():
+		for w_to, _ in mentions:
+			for w_from2 in xrange(w_to + 2, w_to + context_size + 2):
+				pair_n += counts_at.get(w_from2, 0)
+	return pair_n
+
+
 def get_wiki_triples(
 		wikifier_annotations,
 		min_pRank,
-		context_size):
-	# collect annotation mentions sorted by location
-	annot_mentions = []
+		context_size,
+		min_cosine = None,
+		stats = None):
+	"""
+	Collect the triples (first mention url, context, second mention url) for all pairs of mentions
+	with at least one and at most context_size words between them.
+	Mentions of annotations with pageRank below min_pRank (or cosine below min_cosine, if given)
+	are dropped before pairing. If a stats Counter is given, the numbers of all and pruned mentions and pairs are added to it.
+	Mentions are bucketed by their first word, so pairing needs neither sorting nor copying:
+	each mention is only paired with the mentions starting in the window of context_size words after it.
+	Contexts are joined from a slice of the interleaved spaces and words, without repeated string concatenation.
+	"""
+	# mentions (last word, url) bucketed by their first word
+	mentions_at = {}
+	# the pruned mentions are only kept when collecting stats
+	pruned_mentions_at = {}
 	for annotation in wikifier_annotations["annotations"]:
+		pruned = annotation.get("pageRank", 0) < min_pRank or (
+			min_cosine is not None and annotation.get("cosine", 0) < min_cosine)
+		if pruned and stats is None:
+			continue
+		annotation_mentions_at = pruned_mentions_at if pruned else mentions_at
 		for mention in annotation["support"]:
-			annot_mentions.append(
-				((mention["wFrom"], mention["wTo"]),
-				annotation["url"]))
-	annot_mentions.sort()
+			annotation_mentions_at.setdefault(mention["wFrom"], []).append( (mention["wTo"], annotation["url"]) )
+
+	tokens = get_tokens(wikifier_annotations)
 
 	triples = Counter()
+	pair_n = 0
 	# find all mention pairs close enough and collect them with the context in between
-	for m1_i, mention1 in enumerate(annot_mentions):
-		for mention2 in annot_mentions[m1_i+1:]:
-			mention_dist = mention2[0][0] - mention1[0][1]
-			# stop when out of context range
-			if mention_dist > context_size + 1:
-				break
+	for mentions1 in mentions_at.itervalues():
+		for w_to1, url1 in mentions1:
+			# the second mention has to start at least two and at most context_size + 1 words after the first ends
+			for w_from2 in xrange(w_to1 + 2, w_to1 + context_size + 2):
+				mentions2 = mentions_at.get(w_from2)
+				if mentions2 is None:
+					continue
+				context = u"".join(tokens[2 * w_to1 + 3:2 * w_from2])
+				for _, url2 in mentions2:
+					triples[(url1, context, url2)] += 1
+				pair_n += len(mentions2)
+
+	if stats is not None:
+		# count the pairs with at least one pruned mention without building their contexts
+		counts_at = Counter({w_from: len(mentions) for w_from, mentions in mentions_at.iteritems()})
+		counts_at.update({w_from: len(mentions) for w_from, mentions in pruned_mentions_at.iteritems()})
+		all_pair_n = (
+			count_window_pairs(mentions_at, counts_at, context_size) +
+			count_window_pairs(pruned_mentions_at, counts_at, context_size))
+		kept_mention_n = sum(len(mentions) for mentions in mentions_at.itervalues())
+		pruned_mention_n = sum(len(mentions) for mentions in pruned_mentions_at.itervalues())
+		stats.update({
+			'articles': 1,
+			'mentions': kept_mention_n + pruned_mention_n,
+			'mentions_pruned': pruned_mention_n,
+			'pairs': all_pair_n,
+			'pairs_pruned': all_pair_n - pair_n})
+
+	return triples
 
-			# if in range and not overlapping or adjacent, collect triplet with context
-			if mention_dist > 1:
-				context = get_context_between(
-					mention1[0][1],
-					mention2[0][0],
-					wikifier_annotations)
 
-				triples[(mention1[1], context, mention2[1])] += 1
+def log_pruning_stats(stats):
+	"""Log how many mentions and mention pairs were pruned by the annotation thresholds."""
+	logging.info("Pruned %d of %d mentions (%.1f%%) and %d of %d mention pairs (%.1f%%) in %d articles" % (
+		stats['mentions_pruned'],
+		stats['mentions'],
+		100.0 * stats['mentions_pruned'] / max(stats['mentions'], 1),
+		stats['pairs_pruned'],
+		stats['pairs'],
+		100.0 * stats['pairs_pruned'] / max(stats['pairs'], 1),
+		stats['articles']))
 
-	return triples
+
+def log_normalize_stats(stats):
+	"""Log the hit rate of the context normalization caches."""
+	lookups = stats['normalize_hits'] + stats['normalize_misses']
+	logging.info("Normalization cache hits: %d of %d contexts (%.1f%%)" % (
+		stats['normalize_hits'],
+		lookups,
+		100.0 * stats['normalize_hits'] / max(lookups, 1)))
 
 
 def check_nell_patters(nell_patterns, triples):
@@ -208,6 +604,262 @@ def check_nell_patters(nell_patterns, triples):
 	return triples
 
 
+def tokenize_context(context):
+	"""Split a context (or a pattern) into lowercase whitespace-separated tokens."""
+	return context.lower().split()
+
+
+# NELL-like tokens: clitics split from their words ("john's" -> "john 's", "don't" -> "do n't"),
+# words (keeping inner hyphens, dots and ampersands, e.g. "u.s", "at&t") and single punctuation marks
+NORMALIZE_TOKEN_RE = re.compile(
+	r"n't\b|'(?:s|re|ve|ll|d|m)\b|\w+(?=n't\b)|\w+(?:[-.&]\w+)*|[^\w\s]",
+	re.UNICODE)
+NORMALIZE_CHARS = {
+	ord(u"\u2018"): u"'",
+	ord(u"\u2019"): u"'",
+	ord(u"\u201c"): u'"',
+	ord(u"\u201d"): u'"'}
+
+
+def normalize_tokens(context):
+	"""Split a context (or a pattern) into canonical lowercase tokens, separating clitics and punctuation as NELL does."""
+	if isinstance(context, unicode):
+		context = context.translate(NORMALIZE_CHARS)
+	return NORMALIZE_TOKEN_RE.findall(context.lower())
+
+
+def normalize_key(context):
+	"""Canonical key of a context (or a pattern) for exact pattern lookups."""
+	return u" ".join(normalize_tokens(context))
+
+
+class ContextNormalizer(object):
+	"""
+	Memoized normalize_tokens (or normalize_key) for contexts that repeat across articles.
+	The cache holds at most maxsize contexts in two generations: hits in the old generation
+	are moved to the current one, and the old generation is dropped when the current one fills up,
+	which approximates LRU eviction with plain dict operations.
+	"""
+	def __init__(self, maxsize = NORMALIZE_CACHE_SIZE, normalize = normalize_tokens):
+		self.normalize = normalize
+		self.generation_size = max(maxsize // 2, 1)
+		self.clear()
+
+	def clear(self):
+		"""Empty the cache and reset its stats."""
+		self.current = {}
+		self.old = {}
+		self.hits = 0
+		self.misses = 0
+
+	def __call__(self, context):
+		tokens = self.current.get(context)
+		if tokens is not None:
+			self.hits += 1
+			return tokens
+		tokens = self.old.get(context)
+		if tokens is not None:
+			self.hits += 1
+		else:
+			self.misses += 1
+			tokens = self.normalize(context)
+		if len(self.current) >= self.generation_size:
+			self.old = self.current
+			self.current = {}
+		self.current[context] = tokens
+		return tokens
+
+	def __len__(self):
+		return len(self.current) + len(self.old)
+
+
+class PatternMatcher(object):
+	"""
+	Aho-Corasick automaton over the tokens of relation patterns.
+	It is built once from the patterns (e.g. as returned by parse_rel_ptrns) and then finds
+	all patterns occurring anywhere in a context, on token boundaries, in a single pass over its tokens.
+	"""
+	# transitions of all states are kept in a single dict keyed by (state << TOKEN_BITS) | token_id,
+	# which is much more compact than a dict per state for millions of patterns
+	TOKEN_BITS = 32
+
+	def __init__(self, patterns, tokenize = tokenize_context):
+		self.tokenize = tokenize
+		self.token_ids = {}
+		self.transitions = {}
+		# (pattern, pattern token count) recognized at each final state
+		self.outputs = {}
+		state_n = 1
+		# tokens leading to the child states of each state; only needed while building
+		children = [[]]
+		for pattern in patterns:
+			state = 0
+			pattern_tokens = self.tokenize(pattern)
+			for token in pattern_tokens:
+				token_id = self.token_ids.setdefault(token, len(self.token_ids))
+				key = (state << self.TOKEN_BITS) | token_id
+				next_state = self.transitions.get(key)
+				if next_state is None:
+					next_state = state_n
+					state_n += 1
+					self.transitions[key] = next_state
+					children[state].append(token_id)
+					children.append([])
+				state = next_state
+			if state != 0:
+				self.outputs.setdefault(state, []).append( (pattern, len(pattern_tokens)) )
+
+		# compute failure links and output links (to the nearest final state on the failure path) breadth-first
+		self.fail = [0] * state_n
+		self.output_link = [0] * state_n
+		queue = collections.deque([0])
+		while queue:
+			state = queue.popleft()
+			for token_id in children[state]:
+				child = self.transitions[(state << self.TOKEN_BITS) | token_id]
+				if state != 0:
+					fail_state = self._next_state(self.fail[state], token_id)
+					self.fail[child] = fail_state
+					self.output_link[child] = fail_state if fail_state in self.outputs else self.output_link[fail_state]
+				queue.append(child)
+
+		logging.info("Built pattern matcher with %d states for %d patterns" % (state_n, len(patterns)))
+
+	def _next_state(self, state, token_id):
+		"""Follow the failure links until a transition for the token is found."""
+		while True:
+			next_state = self.transitions.get((state << self.TOKEN_BITS) | token_id)
+			if next_state is not None:
+				return next_state
+			if state == 0:
+				return 0
+			state = self.fail[state]
+
+	def match(self, context):
+		"""Return (pattern, start token, end token) for every pattern occurrence in the context."""
+		matches = []
+		state = 0
+		for token_i, token in enumerate(self.tokenize(context)):
+			token_id = self.token_ids.get(token)
+			# a token that is not part of any pattern resets the automaton
+			if token_id is None:
+				state = 0
+				continue
+			state = self._next_state(state, token_id)
+			# collect the patterns ending at this token
+			final_state = state if state in self.outputs else self.output_link[state]
+			while final_state != 0:
+				for pattern, token_n in self.outputs[final_state]:
+					matches.append( (pattern, token_i + 1 - token_n, token_i + 1) )
+				final_state = self.output_link[final_state]
+		return matches
+
+	def match_relations(self, context, nell_patterns):
+		"""Return (pattern, relations of the pattern in nell_patterns) for every pattern occurrence in the context."""
+		return [(pattern, nell_patterns[pattern]) for pattern, _, _ in self.match(context)]
+
+
+class IndexPatternMatcher(object):
+	"""
+	Finds patterns in contexts with key lookups in a PatternIndex instead of an in-memory automaton.
+	The token n-grams of a context (up to the longest pattern) are looked up in a single query,
+	which returns the matching patterns together with their relations. Results are memoized per context
+	(as in ContextNormalizer), so contexts repeating across articles are not looked up again.
+	"""
+	# most n-gram keys sent to sqlite in a single query (sqlite allows 999 parameters)
+	MAX_QUERY_KEYS = 500
+
+	def __init__(self, index, tokenize = normalize_tokens, cache_size = NORMALIZE_CACHE_SIZE):
+		self.index = index
+		self.tokenize = tokenize
+		self.max_tokens = index.max_pattern_tokens
+		self.cache = ContextNormalizer(cache_size, normalize = self._match_relations)
+		logging.info("Matching %d patterns of up to %d tokens in index %s" % (len(index), self.max_tokens, index.index_fnm))
+
+	def _ngram_keys(self, context):
+		"""Map the keys of all token n-grams of the context (as built by normalize_key) to their (start, end) token positions."""
+		tokens = self.tokenize(context)
+		keys = {}
+		for start in xrange(len(tokens)):
+			for end in xrange(start + 1, min(start + self.max_tokens, len(tokens)) + 1):
+				keys.setdefault(u" ".join(tokens[start:end]), []).append( (start, end) )
+		return keys
+
+	def _lookup(self, keys):
+		"""Return (matches, relations): (pattern, start, end) of each occurrence and the relations of the matched patterns."""
+		matches = []
+		relations = {}
+		key_list = list(keys)
+		for chunk_start in xrange(0, len(key_list), self.MAX_QUERY_KEYS):
+			chunk_keys = key_list[chunk_start:chunk_start + self.MAX_QUERY_KEYS]
+			for key, pattern, pattern_rel in self.index.lookup_keys(chunk_keys):
+				if pattern not in relations:
+					relations[pattern] = []
+					matches.extend((pattern, start, end) for start, end in keys[key])
+				relations[pattern].append(pattern_rel)
+		return matches, relations
+
+	def _match_relations(self, context):
+		matches, relations = self._lookup(self._ngram_keys(context))
+		return [(pattern, relations[pattern]) for pattern, _, _ in matches]
+
+	def match(self, context):
+		"""Return (pattern, start token, end token) for every pattern occurrence in the context."""
+		matches, _ = self._lookup(self._ngram_keys(context))
+		return matches
+
+	def match_relations(self, context, nell_patterns = None):
+		"""Return (pattern, relations of the pattern) for every pattern occurrence in the context (relations are read from the index)."""
+		return self.cache(context)
+
+
+class CachedPatternMatcher(object):
+	"""
+	Memoizes the match_relations results of a PatternMatcher per context (as in ContextNormalizer),
+	so a context repeating across articles costs a single dict lookup instead of a pass of the automaton.
+	"""
+	def __init__(self, matcher, nell_patterns, cache_size = NORMALIZE_CACHE_SIZE):
+		self.matcher = matcher
+		self.cache = ContextNormalizer(cache_size, normalize = lambda context: matcher.match_relations(context, nell_patterns))
+
+	def match(self, context):
+		return self.matcher.match(context)
+
+	def match_relations(self, context, nell_patterns = None):
+		"""Return (pattern, relations of the pattern) for every pattern occurrence in the context (relations of the patterns given at construction)."""
+		return self.cache(context)
+
+
+def match_nell_patterns(matcher, nell_patterns, triples):
+	"""
+	Find patterns of NELL relations anywhere in the contexts of the triples.
+	Return a Counter of relation instances (relation name, first argument, second argument, pattern)
+	with the arguments ordered as required by the matched pattern.
+	"""
+	relation_instances = Counter()
+	for (arg1, context, arg2), cnt in triples.iteritems():
+		for pattern, pattern_rels in matcher.match_relations(context, nell_patterns):
+			# the same pattern can indicate multiple relations
+			for pattern_rel in pattern_rels:
+				if pattern_rel['order'] == '1-2':
+					relation_instances[(pattern_rel['rel']['name'], arg1, arg2, pattern)] += cnt
+				else:
+					relation_instances[(pattern_rel['rel']['name'], arg2, arg1, pattern)] += cnt
+	return relation_instances
+
+
+def split_pattern(pattern):
+	"""
+	Clip the explicit arguments from a pattern such as 'arg1 is the CEO of arg2'.
+	Return the clipped pattern and the argument order ('1-2' or '2-1') or (None, None) if the pattern is malformed.
+	"""
+	if pattern.startswith('arg1') and pattern.endswith('arg2'):
+		return pattern[5:-5], '1-2'
+	elif pattern.startswith('arg2') and pattern.endswith('arg1'):
+		return pattern[5:-5], '2-1'
+	return None, None
+
+
 def parse_rel_ptrns(rel_data_fnm):
 	"""Parse relation patterns from jsonl dump."""
 	logging.info('Reading relation data from %s' % rel_data_fnm)
@@ -237,16 +889,11 @@ def parse_rel_ptrns(rel_data_fnm):
 			# load patterns and link them to the relation
 			for pattern in rel_data['metadata']['extractionPatterns']:
 				# pattern is expected to be properly formatted
-				order = None
-				if pattern.startswith('arg1') and pattern.endswith('arg2'):
-					order = '1-2'
-				elif pattern.startswith('arg2') and pattern.endswith('arg1'):
-					order = '2-1'
-				else:
+				ptrn, order = split_pattern(pattern)
+				if ptrn is None:
 					print "skipped pattern for rel: %s - %s" % (rel['name'], pattern)
 					continue
-				# clip the explicit arguments and link relation and pattern
-				ptrn = pattern[5:-5]
+				# link relation and pattern
 				rel['patterns'].append(ptrn)
 				# the same pattern can indicate multiple relations
 				pattern_rels = patterns.get(ptrn, [])
@@ -259,30 +906,292 @@ def parse_rel_ptrns(rel_data_fnm):
 
 	return rels, patterns
 
-def main_extract(args):
-	# parse relations and patterns data
+def compile_pattern_index(rels, patterns, index_fnm):
+	"""
+	Compile relations and their patterns (as returned by parse_rel_ptrns) into an sqlite index file.
+	Extraction processes open it with PatternIndex instead of parsing and holding all patterns in memory.
+	"""
+	logging.info("Compiling index of %d patterns into %s" % (len(patterns), index_fnm))
+	if os.path.exists(index_fnm):
+		os.remove(index_fnm)
+	conn = sqlite3.connect(index_fnm)
+	conn.execute("PRAGMA journal_mode = OFF")
+	conn.execute("PRAGMA synchronous = OFF")
+	conn.execute("CREATE TABLE relations (rel_id INTEGER PRIMARY KEY, name TEXT, range TEXT, domain TEXT, uri TEXT)")
+	conn.execute("CREATE TABLE patterns (pattern TEXT NOT NULL, pattern_key TEXT NOT NULL, rel_id INTEGER NOT NULL, arg_order TEXT NOT NULL)")
+	conn.execute("CREATE TABLE meta (name TEXT PRIMARY KEY, value INTEGER)")
+
+	rel_ids = {}
+	for rel_id, rel in enumerate(rels):
+		rel_ids[id(rel)] = rel_id
+		conn.execute(
+			"INSERT INTO relations VALUES (?, ?, ?, ?, ?)",
+			(rel_id, rel['name'], rel.get('range'), rel.get('domain'), rel.get('uri')))
+	# patterns are matched on their normalized keys (see IndexPatternMatcher)
+	pattern_keys = {pattern: normalize_key(pattern) for pattern in patterns}
+	# insert patterns sorted so that the table pages are laid out in lookup order
+	conn.executemany(
+		"INSERT INTO patterns VALUES (?, ?, ?, ?)",
+		((pattern, pattern_keys[pattern], rel_ids[id(pattern_rel['rel'])], pattern_rel['order'])
+			for pattern in sorted(patterns, key = lambda pattern: (pattern_keys[pattern], pattern))
+			for pattern_rel in patterns[pattern]))
+	conn.execute("CREATE INDEX patterns_by_pattern ON patterns (pattern)")
+	conn.execute("CREATE INDEX patterns_by_key ON patterns (pattern_key)")
+	conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+		('pattern_n', len(patterns)),
+		('max_pattern_tokens', max([len(key.split()) for key in pattern_keys.itervalues()] or [0]))])
+	conn.commit()
+	conn.close()
+
+
+class PatternIndex(object):
+	"""
+	Read-only view of a pattern index compiled by compile_pattern_index.
+	Supports the lookups of the patterns dict returned by parse_rel_ptrns (in, [], get, iteration)
+	and lookups by normalized pattern keys (for IndexPatternMatcher) without loading the patterns
+	into the Python heap. The file is memory mapped, so processes using the same index share
+	its pages through the OS page cache.
+	"""
+	def __init__(self, index_fnm, mmap_size = PATTERN_INDEX_MMAP_SIZE):
+		if not os.path.exists(index_fnm):
+			raise IOError("Pattern index %s does not exist" % index_fnm)
+		self.index_fnm = index_fnm
+		self.mmap_size = mmap_size
+		self._connect()
+
+	def _connect(self):
+		self.pid = os.getpid()
+		self.conn = sqlite3.connect(self.index_fnm)
+		self.conn.execute("PRAGMA query_only = 1")
+		self.conn.execute("PRAGMA mmap_size = %d" % self.mmap_size)
+		# relations are few - keep them in memory
+		self.rels = {
+			rel_id: {'name': name, 'range': rel_range, 'domain': domain, 'uri': uri}
+			for rel_id, name, rel_range, domain, uri in self.conn.execute("SELECT * FROM relations")}
+		try:
+			self.meta = dict(self.conn.execute("SELECT name, value FROM meta"))
+		except sqlite3.OperationalError:
+			raise IOError("Pattern index %s was compiled by an older version, compile it again with the index command" % self.index_fnm)
+		self.max_pattern_tokens = self.meta['max_pattern_tokens']
+
+	def _execute(self, query, params = ()):
+		# sqlite connections can not be shared with forked worker processes - reconnect in each process
+		if self.pid != os.getpid():
+			self._connect()
+		return self.conn.execute(query, params)
+
+	def get(self, pattern, default = None):
+		"""Get the relations (and argument orders) indicated by the pattern."""
+		pattern_rels = [
+			{'rel': self.rels[rel_id], 'order': order}
+			for rel_id, order in self._execute(
+				"SELECT rel_id, arg_order FROM patterns WHERE pattern = ?", (pattern,))]
+		return pattern_rels or default
+
+	def __getitem__(self, pattern):
+		pattern_rels = self.get(pattern)
+		if pattern_rels is None:
+			raise KeyError(pattern)
+		return pattern_rels
+
+	def lookup_keys(self, keys):
+		"""Yield (key, pattern, relation with its argument order) for the patterns with any of the normalized keys."""
+		for key, pattern, rel_id, order in self._execute(
+				"SELECT pattern_key, pattern, rel_id, arg_order FROM patterns WHERE pattern_key IN (%s)" % ", ".join("?" * len(keys)),
+				keys):
+			yield key, pattern, {'rel': self.rels[rel_id], 'order': order}
+
+	def __contains__(self, pattern):
+		return self._execute("SELECT 1 FROM patterns WHERE pattern = ? LIMIT 1", (pattern,)).fetchone() is not None
+
+	def __iter__(self):
+		for (pattern,) in self._execute("SELECT DISTINCT pattern FROM patterns ORDER BY pattern"):
+			yield pattern
+
+	def __len__(self):
+		return self.meta['pattern_n']
+
+
+def load_rel_ptrns(rel_fnm):
+	"""Open a compiled pattern index or parse the patterns from a relation data jsonl dump."""
+	if rel_fnm.endswith(PATTERN_INDEX_EXT):
+		return PatternIndex(rel_fnm)
+	_, patterns = parse_rel_ptrns(rel_fnm)
+	return patterns
+
+
+def main_index(args):
 	rels, patterns = parse_rel_ptrns(args.rel_file)
+	compile_pattern_index(rels, patterns, args.index_file)
+
+
+def iter_json_articles(data):
+	"""Find the annotated articles (dicts holding Wikifier output under "annotations") in parsed json data."""
+	if isinstance(data, dict):
+		if isinstance(data.get("annotations"), dict):
+			yield data
+			return
+		values = data.itervalues()
+	elif isinstance(data, list):
+		values = data
+	else:
+		return
+	for value in values:
+		for article in iter_json_articles(value):
+			yield article
 
-	# patterns[", the EU's"] = "test_rel"
 
-	# with open("data/FB_WA_event_annotated.json") as infile:
-	with open(args.arts_file) as infile:
-		article = json.load(infile).values()[0].values()[5]
+def iter_annotated_articles(arts_fnm):
+	"""
+	Stream annotated articles from a json or jsonl file (optionally gzipped).
+	Jsonl files hold one article per line and are read incrementally,
+	json files can hold the articles nested in dicts and lists (e.g. grouped by events).
+	"""
+	with open_maybe_gzip(arts_fnm) as infile:
+		if arts_fnm.endswith(".jsonl") or arts_fnm.endswith(".jsonl.gz"):
+			for line in infile:
+				if not line.isspace():
+					yield json.loads(line)
+		else:
+			for article in iter_json_articles(json.load(infile)):
+				yield article
+
+
+# extraction settings shared with the worker processes (set before the workers are forked)
+_EXTRACTION = {}
+
+
+def _extract_article_relations(article):
+	"""Extract NELL relation instances and pruning stats from a single annotated article (run in worker processes)."""
+	stats = Counter()
+	triples = get_wiki_triples(
+		article["annotations"],
+		_EXTRACTION['min_pRank'],
+		_EXTRACTION['context_size'],
+		_EXTRACTION['min_cosine'],
+		stats)
+	normalizer = _EXTRACTION['normalizer']
+	hits, misses = normalizer.hits, normalizer.misses
+	relations = match_nell_patterns(_EXTRACTION['matcher'], _EXTRACTION['patterns'], triples)
+	stats['normalize_hits'] += normalizer.hits - hits
+	stats['normalize_misses'] += normalizer.misses - misses
+	return relations, stats
+
+
+def extract_relations(
+		patterns,
+		arts_fnms,
+		min_pRank = MIN_PAGE_RANK,
+		context_size = CONTEXT_SIZE,
+		workers = 1,
+		chunk_size = EXTRACT_CHUNK_SIZE,
+		min_cosine = None,
+		normalize_cache_size = NORMALIZE_CACHE_SIZE):
+	"""
+	Extract NELL relation instances from all articles in the given files.
+	Articles are processed by a pool of worker processes and their counts are aggregated.
+	Patterns and contexts are matched on their normalized (NELL-like) tokens.
+	Return a Counter of (relation name, first argument, second argument, pattern).
+	"""
+	# build the matcher once; forked workers share it (each with its own normalization cache)
+	if isinstance(patterns, PatternIndex):
+		# match through the (shared, memory mapped) index instead of building the automaton in memory;
+		# the matcher caches its results per context, which also covers their normalization
+		matcher = IndexPatternMatcher(patterns, cache_size = normalize_cache_size)
+		normalizer = matcher.cache
+	else:
+		# as with the index, whole match results are cached per context, not just its tokens
+		matcher = CachedPatternMatcher(PatternMatcher(patterns, tokenize = normalize_tokens), patterns, normalize_cache_size)
+		normalizer = matcher.cache
+	_EXTRACTION.update({
+		'matcher': matcher,
+		'normalizer': normalizer,
+		'patterns': patterns,
+		'min_pRank': min_pRank,
+		'min_cosine': min_cosine,
+		'context_size': context_size})
+
+	articles = (article for arts_fnm in arts_fnms for article in iter_annotated_articles(arts_fnm))
+
+	relation_counts = Counter()
+	stats = Counter()
+	article_n = 0
+	pool = multiprocessing.Pool(workers) if workers > 1 else None
+	try:
+		if pool is not None:
+			article_relations = pool.imap_unordered(_extract_article_relations, articles, chunk_size)
+		else:
+			article_relations = imap(_extract_article_relations, articles)
+		for relations, article_stats in article_relations:
+			relation_counts.update(relations)
+			stats.update(article_stats)
+			article_n += 1
+			if article_n % 1000 == 0:
+				logging.info("Processed %d articles, found %d relation instances" % (article_n, len(relation_counts)))
+		if pool is not None:
+			pool.close()
+	except:
+		if pool is not None:
+			pool.terminate()
+		raise
+	finally:
+		if pool is not None:
+			pool.join()
+
+	logging.info("Processed %d articles, found %d relation instances" % (article_n, len(relation_counts)))
+	log_pruning_stats(stats)
+	log_normalize_stats(stats)
+	return relation_counts
+
+
+def output_relations(relation_counts, output_jsonl):
+	"""Write relation instances with their counts into a jsonl file, most frequent first."""
+	logging.info("Writing relation instances into %s" % output_jsonl)
+	with open(output_jsonl, 'w') as outfile:
+		for (rel_name, arg1, arg2, pattern), cnt in relation_counts.most_common():
+			outfile.write(json.dumps({
+				'relation': rel_name,
+				'arg1': arg1,
+				'arg2': arg2,
+				'pattern': pattern,
+				'count': cnt}) + "\n")
 
-	all_triples = get_wiki_triples(article["annotations"], 0.003, 5)
 
-	nell_triples = check_nell_patters(patterns, all_triples)
+def main_extract(args):
+	# parse relations and patterns data (or open their compiled index)
+	patterns = load_rel_ptrns(args.rel_file)
 
-	for x in nell_triples.iteritems():
-		print x
+	relation_counts = extract_relations(
+		patterns,
+		args.arts_files,
+		args.min_pRank,
+		args.context_size,
+		args.workers,
+		args.chunk_size,
+		args.min_cosine,
+		args.normalize_cache_size)
 
-	pdb.set_trace()
+	output_relations(relation_counts, args.outfile)
 
 
 def main_dl_rels(args):
 	relation_names = get_NELL_rel_names(args.rel_def)
+	batch_command = None
+	if args.batch_command:
+		batch_command = shlex.split(args.batch_command)
+	elif args.batch:
+		batch_command = get_zenodotus_batch_command(args.zenodotus_jar)
 	#missed_relations = download_relations(["acquired", "worksFor", "fakerel"], "zenodotus.jar", "TEST.jsonl")
-	missed_relations = download_relations(relation_names, args.zenodotus_jar, args.outfile)
+	missed_relations = download_relations(
+		relation_names,
+		args.zenodotus_jar,
+		args.outfile,
+		args.parallelism,
+		args.timeout,
+		args.retries,
+		args.backoff,
+		not args.restart,
+		batch_command)
 
 	print "\nmissed %d relations:" % len(missed_relations)
 	for mr in missed_relations:
@@ -294,20 +1203,41 @@ if __name__ == '__main__':
 	parser = argparse.ArgumentParser(prog="Nell pattern relation extraction code")
 	subparsers = parser.add_subparsers()
 
-	parser_extract = subparsers.add_parser('extract', help='extract relations from file')
-	parser_extract.add_argument('rel_file', type=str, help='NELL relations data jsonl file')
-	parser_extract.add_argument('arts_file', type=str, help='articles json file')
+	parser_extract = subparsers.add_parser('extract', help='extract relations from annotated articles')
+	parser_extract.add_argument('rel_file', type=str, help='NELL relations data jsonl file or its compiled index (%s)' % PATTERN_INDEX_EXT)
+	parser_extract.add_argument('arts_files', type=str, nargs='+', help='annotated articles json or jsonl files (optionally gzipped)')
+	parser_extract.add_argument('-o', '--outfile', type=str, default='relations.jsonl', help='output jsonl filename (default: %(default)s)')
+	parser_extract.add_argument('--min_pRank', type=float, default=MIN_PAGE_RANK, help='minimal pageRank of annotations (default: %(default)s)')
+	parser_extract.add_argument('--min_cosine', type=float, default=None, help='minimal cosine similarity of annotations (default: no limit)')
+	parser_extract.add_argument('--normalize_cache_size', type=int, default=NORMALIZE_CACHE_SIZE, help='number of contexts whose pattern matches are cached by each process (default: %(default)s)')
+	parser_extract.add_argument('--context_size', type=int, default=CONTEXT_SIZE, help='maximal number of words between two mentions (default: %(default)s)')
+	parser_extract.add_argument('--workers', type=int, default=1, help='number of worker processes (default: %(default)s)')
+	parser_extract.add_argument('--chunk_size', type=int, default=EXTRACT_CHUNK_SIZE, help='number of articles sent to a worker at once (default: %(default)s)')
 	parser_extract.set_defaults(action="extract")
 
+	parser_index = subparsers.add_parser('index', help='compile relation patterns into an index file')
+	parser_index.add_argument('rel_file', type=str, help='NELL relations data jsonl file')
+	parser_index.add_argument('index_file', type=str, help='output index filename (%s)' % PATTERN_INDEX_EXT)
+	parser_index.set_defaults(action="index")
+
 	parser_dl = subparsers.add_parser('dl', help='download relation patterns from NELL')
 	parser_dl.add_argument('rel_def', type=str, help='NELL relations tsv file')
-	parser_dl.add_argument('zanodotus_jar', type=str, help='path ot zenodotus jar file')
+	parser_dl.add_argument('zenodotus_jar', type=str, help='path ot zenodotus jar file')
 	parser_dl.add_argument('outfile', type=str, help='output filename')
+	parser_dl.add_argument('--parallelism', type=int, default=ZENODOTUS_PARALLELISM, help='number of concurrent zenodotus calls (default: %(default)s)')
+	parser_dl.add_argument('--timeout', type=float, default=ZENODOTUS_TIMEOUT, help='timeout of a zenodotus call in seconds (default: %(default)s)')
+	parser_dl.add_argument('--retries', type=int, default=ZENODOTUS_RETRIES, help='retries of failed zenodotus calls (default: %(default)s)')
+	parser_dl.add_argument('--backoff', type=float, default=ZENODOTUS_BACKOFF, help='seconds to wait before the first retry, doubled for each next one (default: %(default)s)')
+	parser_dl.add_argument('--restart', action='store_true', default=False, help='overwrite the output file instead of skipping relations already in it')
+	parser_dl.add_argument('--batch', action='store_true', default=False, help='run zenodotus in long-lived helper processes (compile ZenodotusBatch.java first)')
+	parser_dl.add_argument('--batch_command', type=str, default=None, help='command starting the batch helper (implies --batch; default: java -cp <this dir>:<zenodotus_jar> ZenodotusBatch <zenodotus_jar>)')
 	parser_dl.set_defaults(action="dl")
 
 	args = parser.parse_args()
 
 	if args.action == 'extract':
 		main_extract(args)
+	elif args.action == 'index':
+		main_index(args)
 	elif args.action == 'dl':
 		main_dl_rels(args)
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""
+Corpus-level counting of allpairs rows (contexts or triples) with bounded memory.
+Rows are counted in memory until a limit is reached, then spilled to disk as sorted runs
+that are k-way merged into the final counts (as in an external sort).
+"""
+import os
+import io
+import heapq
+import shutil
+import argparse
+import tempfile
+
+# maximal number of distinct rows counted in memory before spilling them to disk
+AGGREGATE_MAX_ITEMS = 2000000
+# buffer size of the run files
+RUN_BUFFER_SIZE = 1024 * 1024
+# maximal number of runs merged at once (each holds an open file)
+MERGE_FAN_IN = 128
+
+
+def encode_row(row):
+	"""Encode a row (tuple of unicode strings) into a utf8 tab-separated key; tabs and newlines in fields become spaces."""
+	return u'\t'.join(
+		field.replace(u'\t', u' ').replace(u'\n', u' ').replace(u'\r', u' ')
+		for field in row).encode('utf8')
+
+
+def iter_count_file(filename):
+	"""Stream the (key, count) pairs of a counts file (rows with the count as the last column)."""
+	with io.open(filename, 'rb', buffering = RUN_BUFFER_SIZE) as infile:
+		for line in infile:
+			key, _, count = line.rstrip('\n').rpartition('\t')
+			yield key, int(count)
+
+
+def merge_counts(sorted_counts):
+	"""Merge sorted streams of (key, count) pairs and sum the counts of equal keys."""
+	merged = heapq.merge(*sorted_counts)
+	try:
+		key, count = next(merged)
+	except StopIteration:
+		return
+	for next_key, next_count in merged:
+		if next_key == key:
+			count += next_count
+		else:
+			yield key, count
+			key, count = next_key, next_count
+	yield key, count
+
+
+class SpillingCounter(object):
+	"""
+	Count rows in a bounded in-memory dict and spill it to sorted run files when it holds max_items rows.
+	iter_counts() merges the runs and the rows still in memory into (key, count) pairs sorted by key,
+	where key is the encoded row (see encode_row). Run files are removed by close().
+	"""
+	def __init__(self, max_items = AGGREGATE_MAX_ITEMS, tmp_dir = None, fan_in = MERGE_FAN_IN):
+		self.max_items = max_items
+		self.fan_in = fan_in
+		self.tmp_dir = tmp_dir
+		self.run_dir = None
+		self.runs = []
+		self.run_n = 0
+		self.spill_n = 0
+		self.counts = {}
+		self.row_n = 0
+	def __enter__(self):
+		return self
+	def __exit__(self, exc_type, exc_value, tb):
+		self.close()
+	def add(self, row, count = 1):
+		key = encode_row(row)
+		self.counts[key] = self.counts.get(key, 0) + count
+		self.row_n += count
+		if len(self.counts) >= self.max_items:
+			self.spill()
+	def update(self, rows):
+		for row in rows:
+			self.add(row)
+	def spill(self):
+		"""Write the counts held in memory into a sorted run file."""
+		if not self.counts:
+			return
+		self.runs.append(self._write_run((key, self.counts[key]) for key in sorted(self.counts)))
+		self.spill_n += 1
+		self.counts = {}
+	def _write_run(self, sorted_counts):
+		if self.run_dir is None:
+			self.run_dir = tempfile.mkdtemp(prefix = 'allpairs_runs_', dir = self.tmp_dir)
+		self.run_n += 1
+		run_fnm = os.path.join(self.run_dir, 'run_%d' % self.run_n)
+		with io.open(run_fnm, 'wb', buffering = RUN_BUFFER_SIZE) as outfile:
+			for key, count in sorted_counts:
+				outfile.write('%s\t%d\n' % (key, count))
+		return run_fnm
+	def _merge_runs(self):
+		"""Merge the runs in passes until at most fan_in of them are left."""
+		while len(self.runs) > self.fan_in:
+			merged_runs, self.runs = self.runs[:self.fan_in], self.runs[self.fan_in:]
+			self.runs.append(self._write_run(merge_counts([iter_count_file(run_fnm) for run_fnm in merged_runs])))
+			for run_fnm in merged_runs:
+				os.remove(run_fnm)
+	def iter_counts(self):
+		"""Iterate over all (key, count) pairs sorted by key."""
+		self._merge_runs()
+		in_memory = sorted(self.counts.iteritems())
+		return merge_counts([iter_count_file(run_fnm) for run_fnm in self.runs] + [iter(in_memory)])
+	def write_counts(self, outfile, min_count = 1):
+		"""Write the sorted counts as tab-separated rows with the count in the last column, return the number of rows written."""
+		written_n = 0
+		for key, count in self.iter_counts():
+			if count >= min_count:
+				outfile.write('%s\t%d\n' % (key, count))
+				written_n += 1
+		return written_n
+	def close(self):
+		if self.run_dir is not None:
+			shutil.rmtree(self.run_dir, ignore_errors = True)
+			self.run_dir = None
+		self.runs = []
+		self.counts = {}
+
+
+def iter_allpairs_rows(filename):
+	"""Stream the rows of a (raw, uncounted) allpairs output file."""
+	with io.open(filename, 'r', encoding = 'utf8', newline = '\n') as infile:
+		for line in infile:
+			line = line.rstrip(u'\n')
+			# skip empty lines (e.g. left between appended outputs)
+			if line:
+				yield tuple(line.split(u'\t'))
+
+
+def aggregate_files(filenames, outfile, max_items = AGGREGATE_MAX_ITEMS, tmp_dir = None, min_count = 1):
+	"""Count the rows of allpairs output files and write them as a sorted counts file."""
+	with SpillingCounter(max_items, tmp_dir) as counter:
+		for filename in filenames:
+			print "aggregating:", filename
+			counter.update(iter_allpairs_rows(filename))
+		with io.open(outfile, 'wb', buffering = RUN_BUFFER_SIZE) as out:
+			written_n = counter.write_counts(out, min_count)
+		print "counted %d rows into %d distinct rows (%d runs spilled to disk)" % (counter.row_n, written_n, counter.spill_n)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Count the rows of allpairs output files (e.g. [outfile]_triples of several shards) into a sorted tsv with the count as the last column.')
+	parser.add_argument('outfile', help='output counts file')
+	parser.add_argument('infiles', nargs='+', help='allpairs output files')
+	parser.add_argument('--max_items', type=int, default=AGGREGATE_MAX_ITEMS, help='distinct rows counted in memory before spilling to disk (default: %(default)s)')
+	parser.add_argument('--tmp_dir', type=str, default=None, help='directory for the spilled runs (default: system temp directory)')
+	parser.add_argument('--min_count', type=int, default=1, help='only output rows seen at least this many times (default: %(default)s)')
+	args = parser.parse_args()
+
+	aggregate_files(args.infiles, args.outfile, args.max_items, args.tmp_dir, args.min_count)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,296 @@
+"""
+Small benchmarks for the allpairs extraction code.
+Run them from this directory, e.g.: python benchmark.py startup --workers 4
+"""
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import resource
+import subprocess
+import multiprocessing
+
+
+def get_memory_kb():
+	"""
+	Return the (resident, private) memory of the current process in kB.
+	Private memory excludes the pages shared with the parent process after forking.
+	"""
+	memory = {}
+	for proc_file in ['/proc/self/status', '/proc/self/smaps_rollup']:
+		if not os.path.exists(proc_file):
+			continue
+		with open(proc_file) as infile:
+			for line in infile:
+				key, _, value = line.partition(':')
+				if value.strip().endswith('kB'):
+					memory[key] = int(value.split()[0])
+	# fall back to peak rss if /proc is not available (ru_maxrss is in kB on linux)
+	rss = memory.get('VmRSS', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+	private = memory.get('Private_Clean', 0) + memory.get('Private_Dirty', 0)
+	return rss, private or None
+
+
+def _worker_memory(_):
+	"""Report the memory of a worker process (sleep a bit so every worker gets a task)."""
+	time.sleep(0.1)
+	return os.getpid(), get_memory_kb()
+
+
+def _startup_child(preload, workers):
+	"""Measure import/preload time and memory in a fresh interpreter and print it as json."""
+	start = time.time()
+	import wikifier_to_allpairs
+	import_time = time.time() - start
+
+	if preload == 'all':
+		langs = sorted(wikifier_to_allpairs.LANG)
+	elif preload == 'none':
+		langs = []
+	else:
+		langs = preload.split(',')
+	start = time.time()
+	wikifier_to_allpairs.SENT_SPLITTER.preload(langs)
+	preload_time = time.time() - start
+
+	parent_rss, _ = get_memory_kb()
+
+	worker_memory = {}
+	if workers:
+		pool = multiprocessing.Pool(workers)
+		worker_memory = dict(pool.map(_worker_memory, range(workers * 4), chunksize=1))
+		pool.close()
+		pool.join()
+
+	print json.dumps({
+		'preload': preload,
+		'import_s': import_time,
+		'preload_s': preload_time,
+		'parent_rss_kb': parent_rss,
+		'worker_rss_kb': [rss for rss, _ in worker_memory.values()],
+		'worker_private_kb': [private for _, private in worker_memory.values()]})
+
+
+def bench_startup(args):
+	"""Compare startup time and per-worker memory with no, some and all sentence splitters loaded."""
+	print "%-16s %10s %10s %12s %16s %16s" % (
+		'preload', 'import s', 'preload s', 'parent MB', 'worker RSS MB', 'worker priv MB')
+	for preload in args.preload:
+		# every configuration runs in its own interpreter so module import is measured from scratch
+		out = subprocess.check_output(
+			[sys.executable, os.path.abspath(__file__), '_startup_child', preload, str(args.workers)])
+		result = json.loads(out.splitlines()[-1])
+
+		def mean_mb(values):
+			values = [v for v in values if v is not None]
+			return '%.1f' % (sum(values) / 1024.0 / len(values)) if values else '-'
+
+		print "%-16s %10.3f %10.3f %12.1f %16s %16s" % (
+			result['preload'],
+			result['import_s'],
+			result['preload_s'],
+			result['parent_rss_kb'] / 1024.0,
+			mean_mb(result['worker_rss_kb']),
+			mean_mb(result['worker_private_kb']))
+
+
+def make_synthetic_article(word_n, mention_n, sent_len, seed = 0):
+	"""
+	Build sentence/word spans and ordered annotation mentions of a synthetic article
+	without going through xml parsing and sentence splitting.
+	"""
+	from wikifier_to_allpairs import TextSpan
+
+	rnd = random.Random(seed)
+	vocabulary = [u'the', u'company', u'said', u'of', u'shares', u'in', u'a', u'deal', u'with', u'reported']
+	words = [rnd.choice(vocabulary) for _ in xrange(word_n)]
+	cleartext = u' '.join(words)
+
+	# character offsets of the words
+	word_ranges = []
+	position = 0
+	for word in words:
+		word_ranges.append((position, position + len(word)))
+		position += len(word) + 1
+
+	sw_spans = []
+	for sent_start in xrange(0, word_n, sent_len):
+		word_spans = [TextSpan(s, e, source=cleartext) for s, e in word_ranges[sent_start:sent_start + sent_len]]
+		s, e = word_spans[0].start, word_spans[-1].end
+		sw_spans.append((TextSpan(s, e, source=cleartext), word_spans))
+
+	# mentions of one to three words that neither overlap nor cross sentence borders
+	annotations = []
+	last_end = -1
+	for word_i in sorted(rnd.sample(xrange(word_n), mention_n)):
+		word_j = min(word_i + rnd.randint(0, 2), (word_i // sent_len + 1) * sent_len - 1, word_n - 1)
+		if word_i <= last_end:
+			continue
+		s, e = word_ranges[word_i][0], word_ranges[word_j][1]
+		annotations.append(TextSpan(s, e, annotation=word_i, source=cleartext))
+		last_end = word_j
+
+	return sw_spans, annotations
+
+
+def legacy_merge_spans(sw_spans, annotations):
+	"""The original bucketing and merging: copies the remaining annotations for every sentence and merged mention."""
+	sent_annotations = []
+	for sent_span, _ in sw_spans:
+		i = 0
+		while i < len(annotations) and annotations[i].end <= sent_span.end:
+			i += 1
+		sent_annotations.append(annotations[:i])
+		annotations = annotations[i:]
+
+	sent_merged_spans = []
+	for (sent_span, word_spans), sas in zip(sw_spans, sent_annotations):
+		merged_spans = []
+		tmp_annotations = [a for a in sas]
+		for word_span in word_spans:
+			if merged_spans != [] and word_span.sub(merged_spans[-1]):
+				continue
+			elif tmp_annotations != [] and word_span.sub(tmp_annotations[0]):
+				merged_spans.append(tmp_annotations.pop(0))
+			else:
+				merged_spans.append(word_span)
+		sent_merged_spans.append(merged_spans)
+	return sent_merged_spans
+
+
+def linear_merge_spans(sw_spans, annotations):
+	"""The single-sweep bucketing and merging."""
+	from wikifier_to_allpairs import split_annotations_by_sentences, merge_sentence_spans
+
+	return [
+		merge_sentence_spans(word_spans, sas)
+		for (_, word_spans), sas in zip(sw_spans, split_annotations_by_sentences(sw_spans, annotations))]
+
+
+def get_allpairs_data_merged_sents(sw_spans, sent_merged_spans):
+	"""Compute the allpairs data from merged sentence spans."""
+	from wikifier_to_allpairs import get_allpairs_data_merged
+
+	prec_contexts, succ_contexts, triples = [], [], []
+	for (sent_span, _), merged_spans in zip(sw_spans, sent_merged_spans):
+		pc, sc, tr = get_allpairs_data_merged(sent_span, merged_spans)
+		prec_contexts.extend(pc)
+		succ_contexts.extend(sc)
+		triples.extend(tr)
+	return prec_contexts, succ_contexts, triples
+
+
+def best_time(func, repeat):
+	"""Return the result and the best wall time of repeated calls of func."""
+	times = []
+	for _ in xrange(repeat):
+		start = time.time()
+		result = func()
+		times.append(time.time() - start)
+	return result, min(times)
+
+
+def bench_bucketing(args):
+	"""Compare the original and the linear annotation-to-sentence bucketing on synthetic articles."""
+	from wikifier_to_allpairs import get_allpairs_data_spans
+
+	print "%8s %9s %9s %12s %12s %9s %10s" % (
+		'words', 'mentions', 'sent len', 'legacy s', 'linear s', 'speedup', 'identical')
+	for sent_len in args.sent_len:
+		sw_spans, annotations = make_synthetic_article(args.words, args.mentions, sent_len)
+		# time just the bucketing and merging, the context extraction that follows is shared
+		legacy_merged, legacy_time = best_time(lambda: legacy_merge_spans(sw_spans, annotations), args.repeat)
+		linear_merged, linear_time = best_time(lambda: linear_merge_spans(sw_spans, annotations), args.repeat)
+		identical = (
+			get_allpairs_data_merged_sents(sw_spans, legacy_merged) == get_allpairs_data_spans(sw_spans, annotations))
+		print "%8d %9d %9d %12.4f %12.4f %8.1fx %10s" % (
+			args.words,
+			len(annotations),
+			sent_len,
+			legacy_time,
+			linear_time,
+			legacy_time / linear_time,
+			identical)
+
+
+class LegacyTextSpan(object):
+	"""The original span representation: a plain object holding a copy of its text."""
+	def __init__(self, start, end, text, annotation = None):
+		self.start, self.end = start, end
+		self.annotation = annotation
+		self.text = text
+
+
+def get_span_bytes(span):
+	"""Approximate memory taken by a span object and the text it owns (not the shared source text)."""
+	size = sys.getsizeof(span)
+	if hasattr(span, '__dict__'):
+		size += sys.getsizeof(span.__dict__)
+	text = span.__dict__['text'] if hasattr(span, '__dict__') else span._text
+	if text is not None:
+		size += sys.getsizeof(text)
+	return size
+
+
+def bench_spans(args):
+	"""Compare memory and construction time of the original and the compact word/sentence spans."""
+	import gc
+	from wikifier_to_allpairs import TextSpan
+
+	sw_spans, _ = make_synthetic_article(args.words, 0, args.sent_len)
+	cleartext = sw_spans[0][0].source
+	ranges = [((s.start, s.end), [(w.start, w.end) for w in ws]) for s, ws in sw_spans]
+
+	def build_legacy():
+		return [
+			(LegacyTextSpan(s, e, cleartext[s:e]), [LegacyTextSpan(ws, we, cleartext[ws:we]) for ws, we in word_ranges])
+			for (s, e), word_ranges in ranges]
+
+	def build_compact():
+		return [
+			(TextSpan(s, e, source=cleartext), [TextSpan(ws, we, source=cleartext) for ws, we in word_ranges])
+			for (s, e), word_ranges in ranges]
+
+	print "%-10s %10s %14s %14s %12s" % ('spans', 'objects', 'bytes/article', 'bytes/word', 'build s')
+	for name, build in [('legacy', build_legacy), ('compact', build_compact)]:
+		gc.collect()
+		spans, build_time = best_time(build, args.repeat)
+		all_spans = [span for sent_span, word_spans in spans for span in [sent_span] + word_spans]
+		size = sum(get_span_bytes(span) for span in all_spans)
+		print "%-10s %10d %14d %14.1f %12.4f" % (name, len(all_spans), size, float(size) / args.words, build_time)
+
+
+def main():
+	if len(sys.argv) > 1 and sys.argv[1] == '_startup_child':
+		_startup_child(sys.argv[2], int(sys.argv[3]))
+		return
+
+	parser = argparse.ArgumentParser()
+	subparsers = parser.add_subparsers()
+
+	parser_startup = subparsers.add_parser('startup', help='module startup time and per-worker memory')
+	parser_startup.add_argument('--workers', type=int, default=2, help='number of worker processes (default: %(default)s)')
+	parser_startup.add_argument('--preload', nargs='+', default=['none', 'eng', 'all'], help='languages to preload; comma separated ISO codes, "none" or "all" (default: %(default)s)')
+	parser_startup.set_defaults(func=bench_startup)
+
+	parser_bucketing = subparsers.add_parser('bucketing', help='annotation-to-sentence bucketing on synthetic articles')
+	parser_bucketing.add_argument('--words', type=int, default=50000, help='number of words in the article (default: %(default)s)')
+	parser_bucketing.add_argument('--mentions', type=int, default=20000, help='number of annotation mentions (default: %(default)s)')
+	parser_bucketing.add_argument('--sent_len', type=int, nargs='+', default=[20, 2000, 50000], help='sentence lengths in words (default: %(default)s)')
+	parser_bucketing.add_argument('--repeat', type=int, default=3, help='number of timed runs, the best is reported (default: %(default)s)')
+	parser_bucketing.set_defaults(func=bench_bucketing)
+
+	parser_spans = subparsers.add_parser('spans', help='memory per article of the word/sentence span representation')
+	parser_spans.add_argument('--words', type=int, default=1000, help='number of words in the article (default: %(default)s)')
+	parser_spans.add_argument('--sent_len', type=int, default=20, help='sentence length in words (default: %(default)s)')
+	parser_spans.add_argument('--repeat', type=int, default=3, help='number of timed runs, the best is reported (default: %(default)s)')
+	parser_spans.set_defaults(func=bench_spans)
+
+	args = parser.parse_args()
+	args.func(args)
+
+
+if __name__ == '__main__':
+	main()
@@ -1,13 +1,19 @@
 import os
+import io
+import json
+import bz2
 import gzip
 import pdb
-import codecs
 import argparse
+import multiprocessing
 from lxml import etree
 #from nltk.tokenize.punkt import PunktSentenceTokenizer
 from nltk.data import load
 from nltk.tokenize import WhitespaceTokenizer
-from itertools import izip
+from itertools import izip, imap, islice
+import numpy as np
+
+from aggregate import SpillingCounter, AGGREGATE_MAX_ITEMS
 
 # dict of supported languages; {ISO_code: name}
 LANG = {
@@ -30,21 +36,63 @@ LANG = {
 	"tur": "turkish"
 }
 
-# load nltk's pre-prepared sentence splitters
-SENT_SPLITTER = {
-	lang_code: load('tokenizers/punkt/{0}.pickle'.format(lang)) for lang_code, lang in LANG.iteritems()
-}
+class SentSplitterRegistry(dict):
+	"""
+	Nltk's pre-prepared sentence splitters indexed by language ISO code.
+	A splitter is unpickled the first time its language is requested.
+	"""
+	def __missing__(self, lang_code):
+		splitter = load('tokenizers/punkt/{0}.pickle'.format(LANG[lang_code]))
+		self[lang_code] = splitter
+		return splitter
+	def preload(self, lang_codes):
+		"""Load the splitters for the given languages ahead of use (e.g. before forking workers)."""
+		for lang_code in lang_codes:
+			self[lang_code]
+
+# sentence splitters, loaded on demand
+SENT_SPLITTER = SentSplitterRegistry()
 
 # whitespace tokenizer used for splitting sentences into word spans
 WHITESPACE_TOKNIZER = WhitespaceTokenizer()
 
 CONTEXT_SIZE = 5
 
+# punctuation marks which end a sentence
+SENT_END_PUNCTUATION = {'.', '!', '?'}
+
+# size (in bytes) of the output buffers used when streaming allpairs data into files
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+# number of processed articles after which the streamed allpairs data is flushed to disk
+FLUSH_EVERY = 1000
+# number of files handed to a worker process at once when extracting in parallel
+WORKER_CHUNK_SIZE = 64
+# number of Wikifier articles whose token offsets are computed together
+WIKIFIER_BATCH_SIZE = 256
+# suffixes of the supported output compressions and the compression level used
+COMPRESSION_EXT = {None: '', 'gzip': '.gz', 'bz2': '.bz2'}
+COMPRESS_LEVEL = 6
+
 class TextSpan(object):
-	def __init__(self, start, end, text, annotation = None):
+	# spans are created for every word of every article, so keep them small:
+	# no per-instance __dict__ and, when a source text is given, no copy of the span's text
+	__slots__ = ('start', 'end', 'annotation', 'source', '_text')
+	def __init__(self, start, end, text = None, annotation = None, source = None):
 		self.start, self.end = start, end
 		self.annotation = annotation
-		self.text = text
+		# the span text is either given explicitly or sliced from the source text when needed
+		self.source = source
+		self._text = text
+	@property
+	def text(self):
+		if self._text is None:
+			return self.source[self.start:self.end]
+		return self._text
+	def subtext(self, start, end):
+		"""Get the text between the given offsets relative to the start of the span."""
+		if self._text is None:
+			return self.source[self.start + start:self.start + end]
+		return self._text[start:end]
 	def __repr__(self):
 		return '[%d,%d]' % (self.start, self.end)
 	def __eq__(self, other):
@@ -80,6 +128,48 @@ def get_articles_from_NF_file(filename, lang={'eng'}):
     return [article for article in xml.getroot() if article.xpath('lang')[0].text in lang]
 
 
+def open_maybe_gzip(fnm):
+	"""Unzip a file before opening if its filename ends with .gz."""
+	if fnm.endswith(".gz"):
+		return gzip.open(fnm, 'rb')
+	else:
+		return open(fnm, 'rb')
+
+
+def iter_articles_from_NF_file(filename, lang={'eng'}):
+	"""
+	Incrementally parse the annotated articles from the (optionally gzipped) Newsfeed xml file.
+	Articles in the desired languages are yielded one at a time and cleared once processed,
+	so memory use stays flat regardless of the size of the dump.
+	"""
+	with open_maybe_gzip(filename) as infile:
+		depth = 0
+		for event, element in etree.iterparse(infile, events=('start', 'end')):
+			if event == 'start':
+				depth += 1
+				continue
+			depth -= 1
+			# articles are the direct children of the root element
+			if depth != 1:
+				continue
+			# take just the articles with desired languages
+			if element.findtext('lang') in lang:
+				yield element
+			# free the processed article and drop the references to it (and preceding articles) from the root
+			element.clear()
+			while element.getprevious() is not None:
+				del element.getparent()[0]
+
+
+def iter_wikifier_articles(filename):
+	"""Stream Wikifier-annotated articles from a (gzipped) jsonl file with one article per line."""
+	with open_maybe_gzip(filename) as infile:
+		for line in infile:
+			if line.isspace():
+				continue
+			yield json.loads(line)
+
+
 def get_articles_from_annotator_file(filename):
     """Parse the annotated articles from the xml file obtained directly from the annotation service."""
     xml = etree.parse(filename)
@@ -124,7 +214,7 @@ def parse_article_text(cleartext, lang):
 	# split text to sentence spans
 	sent_spans = SENT_SPLITTER[lang].span_tokenize(cleartext)
 	# remove punctuation
-	sent_spans = [(s,e-1) if cleartext[e-1] in {'.', '!', '?'} else (s,e) for s,e in sent_spans]
+	sent_spans = [(s,e-1) if cleartext[e-1] in SENT_END_PUNCTUATION else (s,e) for s,e in sent_spans]
 
 	# split the senteces into words
 	spans = []
@@ -142,9 +232,9 @@ def parse_article_text(cleartext, lang):
 			if cleartext[word_end - 1] in {',', ';'}:
 				word_end -= 1
 			# create the textSpan object representing the word
-			word_spans.append(TextSpan(word_start, word_end, cleartext[word_start:word_end]))
+			word_spans.append(TextSpan(word_start, word_end, source=cleartext))
 		# create the textSpan object representing the sentence
-		spans.append( (TextSpan(sent_start, sent_end, cleartext[sent_start:sent_end]), word_spans) )
+		spans.append( (TextSpan(sent_start, sent_end, source=cleartext), word_spans) )
 
 	# spans = [(TextSpan(s, e, cleartext[s:e]), [TextSpan(s + x[0], s + x[1], cleartext[s + x[0]:s + x[1]]) for x in WHITESPACE_TOKNIZER.span_tokenize(cleartext[s:e])]) for s,e in sent_spans]
 
@@ -171,71 +261,145 @@ def get_xlike_annotations(article, cleartext):
 			m_start = int(mention.get('start'))
 			m_end = int(mention.get('end'))
 			# build the textSpan object representing the anotation mention
-			ordered_annotations.append( TextSpan(m_start, m_end, cleartext[m_start:m_end], annotation) )
+			ordered_annotations.append( TextSpan(m_start, m_end, annotation=annotation, source=cleartext) )
 	ordered_annotations = sorted(ordered_annotations, cmp = lambda a,b: a.end - b.start)
 
 	return ordered_annotations
 
 
-def cumsum(values):
-	"""Return the cumulative sum of values in a list."""
-	cSum = [values[0]]
-	for v in values[1:]:
-		cSum.append( cSum[-1] + v )
-	return cSum
+def get_wikifier_response(record):
+	"""
+	Get the Wikifier annotation output from an input record.
+	Records can either be the Wikifier output itself or articles holding it under "annotations".
+	"""
+	if "words" not in record and isinstance(record.get("annotations"), dict):
+		return record["annotations"]
+	return record
+
+
+def get_wikifier_token_ranges_batch(articles):
+	"""
+	Compute the text and the character ranges of the words of a batch of Wikifier articles.
+	The words and spaces of all articles are joined into one text buffer and the ranges
+	are computed with a single vectorized length/cumsum pass over all their tokens.
+	Returns the joined text and a list of word ranges (indices into the text) for each article.
+	"""
+	# combine words an their preceding spaces (spaces[0] + words[0] + spaces[1] + words[1] + ... + spaces[N-1] + words[N-1] + spaces[N])
+	tokens = []
+	article_offsets = []
+	for article in articles:
+		assert len(article["spaces"]) == len(article["words"]) + 1, "Expected N words and N+1 spaces"
+		article_tokens = [None] * (2 * len(article["words"]) + 1)
+		article_tokens[0::2] = article["spaces"]
+		article_tokens[1::2] = article["words"]
+		article_offsets.append(len(tokens))
+		tokens.extend(article_tokens)
+	article_offsets.append(len(tokens))
+
+	# compute token borders in the joined text
+	token_borders = np.zeros(len(tokens) + 1, dtype=np.int64)
+	np.cumsum(np.fromiter(imap(len, tokens), dtype=np.int64, count=len(tokens)), out=token_borders[1:])
+
+	# words are every other token starting with the second token of each article
+	batch_word_ranges = []
+	for token_start, token_end in izip(article_offsets[:-1], article_offsets[1:]):
+		word_starts = token_borders[token_start + 1:token_end:2]
+		word_ends = token_borders[token_start + 2:token_end + 1:2]
+		batch_word_ranges.append(zip(word_starts.tolist(), word_ends.tolist()))
+
+	return u''.join(tokens), batch_word_ranges
+
+
+def get_wikifier_token_ranges(article):
+	"""
+	Compute the article text and the character ranges of its words from the Wikifier words/spaces arrays.
+	The text is joined only once and is shared as the source of all the article's spans.
+	"""
+	text, [word_ranges] = get_wikifier_token_ranges_batch([article])
+	return text, word_ranges
 
 
-def get_wikifier_annotations(article):
+def get_wikifier_annotations(article, text = None, word_ranges = None):
 	"""
 	Collect Wikifier annotations and return the ordered by mentions.
 	This function expects the wikifier annotation output json as input.
+	The article text and word ranges are computed if not given.
 	"""
 	assert "annotations" in article, "Expected annotated articles"
 
-	# compute character ranges of all words and spaces that comprise the article
-	# first combine spaces and word into a common list
-	assert len(article["spaces"]) == len(article["words"]) + 1, "Expected N words and N+1 spaces"
-	tokens = []
-	# combine words an their preceding spaces (spaces[0] + words[0] + spaces[1] + words[1] + ... + spaces[N-1] + words[N-1] + spaces[N])
-	for word_i in xrange(len(article["words"])):
-		tokens.extend([article["spaces"][word_i], article["words"][word_i]])
-	# addd the final space
-	tokens.append(article["spaces"][-1])
-	# compute token lengths and character ranges
-	token_lengths = [len(token) for token in tokens]
-	token_borders = [0] + cumsum(token_lengths)
-	token_ranges = zip( token_borders[:-1], token_borders[1:] )
-	# split to word and space ranges
-	word_ranges = [token_ranges[i] for i in xrange(1, len(token_ranges), 2)]
-	spaces_ranges = [token_ranges[i] for i in xrange(0, len(token_ranges), 2)]
+	if word_ranges is None:
+		text, word_ranges = get_wikifier_token_ranges(article)
 
 	# go over all annotations in the article
 	ordered_annotations = []
 	for annotation in article["annotations"]:
 		for mention in annotation["support"]:
-			# parse mention word indices
+			# parse mention word indices (the end word is included in the mention)
 			m_start = int(mention["wFrom"])
 			m_end = int(mention["wTo"])
-			# building the mention string - start with the first word
-			m_str = article["words"][m_start]
-			# add the rest (if any)
-			m_str += "".join([
-				article["words"][i] + article["spaces"][i]
-				for i in xrange(m_start + 1, m_end)])
-			# # add the last word if necessary
-			# if m_start < m_end:
-			# 	m_str += article["words"][m_end]
 			# build the textSpan object representing the anotation mention
 			ordered_annotations.append( TextSpan(
 				word_ranges[m_start][0],
 				word_ranges[m_end][1],
-				m_str,
-				annotation) )
-	ordered_annotations = sorted(ordered_annotations, cmp = lambda a,b: a.end - b.start)
+				annotation = annotation,
+				source = text) )
+	ordered_annotations.sort(key = lambda a: (a.start, -a.end))
 
 	return ordered_annotations
 
 
+def drop_overlapping_mentions(annotations):
+	"""
+	Keep only the mentions not overlapping any preceding mention.
+	Annotations are expected to be ordered by their start and, for equal starts, longest first.
+	"""
+	kept_annotations = []
+	for annotation in annotations:
+		if kept_annotations and annotation.start < kept_annotations[-1].end:
+			continue
+		kept_annotations.append(annotation)
+	return kept_annotations
+
+
+def parse_wikifier_text(article, text, word_ranges):
+	"""
+	Compute sentence and word spans straight from the Wikifier words/spaces arrays.
+	Wikifier keeps the punctuation in the spaces between words,
+	so a sentence ends at each word followed by a sentence ending punctuation mark.
+	"""
+	spans = []
+	word_spans = []
+	last_word_i = len(word_ranges) - 1
+	for word_i, (word_start, word_end) in enumerate(word_ranges):
+		word_spans.append(TextSpan(word_start, word_end, source=text))
+		# spaces[word_i + 1] is the text following the word
+		if word_i == last_word_i or not SENT_END_PUNCTUATION.isdisjoint(article["spaces"][word_i + 1]):
+			spans.append( (TextSpan(word_spans[0].start, word_spans[-1].end, source=text), word_spans) )
+			word_spans = []
+	return spans
+
+
+def get_allpairs_data_wikifier_batch(articles):
+	"""Produce allpairs data for each article of a batch of articles annotated by Wikifier."""
+	articles = [get_wikifier_response(article) for article in articles]
+	# join the text and compute word ranges only once for the whole batch
+	text, batch_word_ranges = get_wikifier_token_ranges_batch(articles)
+
+	allpairs_data = []
+	for article, word_ranges in izip(articles, batch_word_ranges):
+		sw_spans = parse_wikifier_text(article, text, word_ranges)
+		# Wikifier can link the same words to several concepts - use just one of them
+		annotations = drop_overlapping_mentions(get_wikifier_annotations(article, text, word_ranges))
+		allpairs_data.append(get_allpairs_data_spans(sw_spans, annotations))
+	return allpairs_data
+
+
+def get_allpairs_data_wikifier(article):
+	"""Produce allpairs data from an article annotated by Wikifier."""
+	[allpairs_data] = get_allpairs_data_wikifier_batch([article])
+	return allpairs_data
+
+
 def get_allpairs_data(article, lang = None):
 	"""Produce allpairs data from an annotated article."""
 	# get article cleartext
@@ -249,17 +413,30 @@ def get_allpairs_data(article, lang = None):
 	# get annotations and order them by their mentions
 	annotations = get_xlike_annotations(article, cleartext)
 
-	# split annotations by sentences
+	return get_allpairs_data_spans(sw_spans, annotations)
+
+
+def split_annotations_by_sentences(sw_spans, annotations):
+	"""
+	Split the ordered annotation mentions by the ordered sentences.
+	Done in a single sweep over both lists, annotations are never copied more than once.
+	"""
 	sent_annotations = []
+	annotation_i, annotation_n = 0, len(annotations)
 	# iterate over ordered sentences
 	for sent_span, _ in sw_spans:
-		i = 0
+		sent_start_i = annotation_i
 		# collect all annotation mentions in the current sentence
-		while i < len(annotations) and annotations[i].end <= sent_span.end:
-			i += 1
-		# pop the collected annotations
-		sent_annotations.append(annotations[:i])
-		annotations = annotations[i:]
+		while annotation_i < annotation_n and annotations[annotation_i].end <= sent_span.end:
+			annotation_i += 1
+		sent_annotations.append(annotations[sent_start_i:annotation_i])
+	return sent_annotations
+
+
+def get_allpairs_data_spans(sw_spans, annotations):
+	"""Produce allpairs data from sentence/word spans and the annotation mentions ordered by position."""
+	# split annotations by sentences
+	sent_annotations = split_annotations_by_sentences(sw_spans, annotations)
 
 	# # DEBUG
 	# for sent, sas in izip(sw_spans, sent_annotations):
@@ -281,9 +458,10 @@ def get_allpairs_data(article, lang = None):
 	return prec_contexts, succ_contexts, triples
 
 
-def get_allpairs_data_article_list(article_list, return_spec=['contexts', 'triples'], lang=None):
+def get_allpairs_data_article_list(article_list, return_spec=['contexts', 'triples'], lang=None, input_format='xlike'):
 	"""
 	Produce allpairs data from a list of annotated articles.
+	Articles are either xlike xml elements or Wikifier json records (input_format 'wikifier').
 	Return either just the contexts or the triples or both.
 	"""
 	if not ('contexts' in return_spec or 'triples' in return_spec):
@@ -294,8 +472,13 @@ def get_allpairs_data_article_list(article_list, return_spec=['contexts', 'tripl
 	if 'triples' in return_spec:
 		triples = []
 
-	for article in article_list:
-		pc, sc, trip = get_allpairs_data(article, lang)
+	# Wikifier articles are processed as a single batch
+	if input_format == 'wikifier':
+		allpairs_data = get_allpairs_data_wikifier_batch(article_list)
+	else:
+		allpairs_data = (get_allpairs_data(article, lang) for article in article_list)
+
+	for pc, sc, trip in allpairs_data:
 		if 'contexts' in return_spec:
 			contexts.extend(sc)
 			contexts.extend([(entity, context) for (context, entity) in pc])
@@ -310,13 +493,13 @@ def get_allpairs_data_article_list(article_list, return_spec=['contexts', 'tripl
 		return triples
 
 
-def get_allpairs_data_article(article, return_spec=['contexts', 'triples'], lang=None):
+def get_allpairs_data_article(article, return_spec=['contexts', 'triples'], lang=None, input_format='xlike'):
 	"""
 	Produce allpairs data from an annotated article.
 	Return either just the contexts or the triples or both.
 	"""
 	# wrap article in a single-element-list and call the list function
-	return get_allpairs_data_article_list([article], return_spec, lang)
+	return get_allpairs_data_article_list([article], return_spec, lang, input_format)
 
 
 def to_sent_index(index, sentence_span):
@@ -324,21 +507,32 @@ def to_sent_index(index, sentence_span):
 	return index - sentence_span.start
 
 
-def get_allpairs_data_sent(sentence_span, word_spans, annotations):
-	"""Get allpairs data for given sentence."""
+def merge_sentence_spans(word_spans, annotations):
+	"""Merge the sentence words and annotation mentions into a single ordered list of spans."""
 	merged_spans = []
-	tmp_annotations = [a for a in annotations]
+	# index of the next unused annotation
+	annotation_i, annotation_n = 0, len(annotations)
 	for word_span in word_spans:
 		# if the current word is already covered by the last span (annotation) in the merged spans skip it
-		if merged_spans != [] and word_span.sub(merged_spans[-1]):
+		if merged_spans and word_span.sub(merged_spans[-1]):
 			continue
 		# if the current word is covered by the next annotation add the annotation to the merged spans and skip the word
-		elif tmp_annotations != [] and word_span.sub(tmp_annotations[0]):
-			merged_spans.append(tmp_annotations.pop(0))
+		elif annotation_i < annotation_n and word_span.sub(annotations[annotation_i]):
+			merged_spans.append(annotations[annotation_i])
+			annotation_i += 1
 		# if the current word is not covered by any annotation add it to the merged spans
 		else:
 			merged_spans.append(word_span)
+	return merged_spans
 
+
+def get_allpairs_data_sent(sentence_span, word_spans, annotations):
+	"""Get allpairs data for given sentence."""
+	return get_allpairs_data_merged(sentence_span, merge_sentence_spans(word_spans, annotations))
+
+
+def get_allpairs_data_merged(sentence_span, merged_spans):
+	"""Get allpairs data for a sentence given as the ordered list of its words and annotation mentions."""
 	# initialize allpairs data lists
 	prec_contexts, succ_contexts, triples = [], [], []
 
@@ -373,7 +567,7 @@ def get_allpairs_data_sent(sentence_span, word_spans, annotations):
 				context_start = to_sent_index(merged_spans[prev_i].start, sentence_span)
 				context_end = to_sent_index(merged_spans[el_i-1].end, sentence_span)
 				# collect the preceding context; add underscore to indicate where the entity occurs
-				prec_contexts.append( (sentence_span.text[context_start:context_end] + '_' , element_span.text) )
+				prec_contexts.append( (sentence_span.subtext(context_start, context_end) + '_' , element_span.text) )
 
 			####################################################################
 			# CHECK SUCCEEDING CONTEXT (+ TRIPLETS)
@@ -395,7 +589,7 @@ def get_allpairs_data_sent(sentence_span, word_spans, annotations):
 					context_end = to_sent_index(merged_spans[succ_i-1].end, sentence_span)
 					# collect the triple if the two annotations are not one next to the other
 					if context_end - context_start > 1:
-						triples.append( (element_span.text, sentence_span.text[context_start:context_end], merged_spans[succ_i].text) )
+						triples.append( (element_span.text, sentence_span.subtext(context_start, context_end), merged_spans[succ_i].text) )
 					break
 
 			# if we reached the first element out of context, fix back the index
@@ -407,7 +601,7 @@ def get_allpairs_data_sent(sentence_span, word_spans, annotations):
 				# compute sentence-relative context borders
 				context_start = to_sent_index(merged_spans[el_i+1].start, sentence_span)
 				context_end = to_sent_index(merged_spans[succ_i].end, sentence_span)
-				succ_contexts.append( (element_span.text, '_' + sentence_span.text[context_start:context_end]) )
+				succ_contexts.append( (element_span.text, '_' + sentence_span.subtext(context_start, context_end)) )
 
 
 
@@ -417,53 +611,361 @@ def get_allpairs_data_sent(sentence_span, word_spans, annotations):
 	return prec_contexts, succ_contexts, triples
 
 
-def output_allpairs_data(filename, contexts=None, triples=None, append = False):
+def write_rows(outfile, rows):
+	"""Write allpairs data in tab-separated columns, one row per line."""
+	if rows:
+		outfile.write(u''.join(u'\t'.join(data_tuple) + u'\n' for data_tuple in rows).encode('utf8'))
+
+
+def output_allpairs_data(filename, contexts=None, triples=None, append = False, compression = None, dedup = False):
 	"""
-	Write allpairs data into separate files.
+	Write allpairs data into separate files (as AllpairsWriter does).
+	Only the files of the given data are written, so the other file is left as it is.
 	Can also append data to existing files.
 	"""
+	if append and dedup:
+		raise ValueError("Deduplicated output can not be appended to")
 	# file opening mode set to append if specified
-	file_mode = "a" if append else "w"
+	file_mode = "ab" if append else "wb"
 
 	# output each dataset in its own file with the appropriate suffix
-	if contexts is not None:
-		with codecs.open(filename + '_contexts', file_mode, encoding = 'utf8') as outfile:
-			# if appending to file first add newline to separate from previous content
-			if append:
-				outfile.write('\n')
-			# write data in tab-separated columns
-			outfile.write('\n'.join('\t'.join(data_tuple) for data_tuple in contexts))
-
-	if triples is not None:
-		with codecs.open(filename + '_triples', file_mode, encoding = 'utf8') as outfile:
-			# if appending to file first add newline to separate from previous content
-			if append:
-				outfile.write('\n')
-			# write data in tab-separated columns
-			outfile.write('\n'.join('\t'.join(data_tuple) for data_tuple in triples))
-
-
-def process_dir(directory, lang, outfile):
-	"""Extract allpairs data from all xml files in the given directory."""
-	# initialize aggregation lists
-	contexts, triples = [], []
-	for filename in os.listdir(directory):
-		# print progress
-		filepath = os.path.join(directory, filename)
-		print "processing:", filepath
+	for suffix, rows in [('_contexts', contexts), ('_triples', triples)]:
+		if rows is None:
+			continue
+		outfile = open_output(filename + suffix + COMPRESSION_EXT[compression], file_mode, OUTPUT_BUFFER_SIZE, compression)
+		try:
+			if dedup:
+				with SpillingCounter() as counter:
+					counter.update(rows)
+					counter.write_counts(outfile)
+			else:
+				write_rows(outfile, rows)
+		finally:
+			outfile.close()
+
+
+class BZ2Output(io.RawIOBase):
+	"""Writable raw stream compressing its data into a bz2 file (the python 2 BZ2File can not be flushed or buffered)."""
+	def __init__(self, filename, mode = 'wb', compresslevel = 9):
+		self.outfile = io.open(filename, mode)
+		self.compressor = bz2.BZ2Compressor(compresslevel)
+	def writable(self):
+		return True
+	def write(self, data):
+		self.outfile.write(self.compressor.compress(data.tobytes() if isinstance(data, memoryview) else data))
+		return len(data)
+	def flush(self):
+		if not self.closed:
+			self.outfile.flush()
+	def fileno(self):
+		return self.outfile.fileno()
+	def close(self):
+		if not self.closed:
+			self.outfile.write(self.compressor.flush())
+			super(BZ2Output, self).close()
+			self.outfile.close()
+
+
+def open_output(filename, file_mode, buffer_size, compression = None):
+	"""Open a buffered binary output file, compressed on the fly if compression ('gzip' or 'bz2') is given."""
+	if compression == 'gzip':
+		# appending adds a new gzip member, which gzip readers concatenate
+		return io.BufferedWriter(gzip.GzipFile(filename, file_mode, COMPRESS_LEVEL), buffer_size)
+	elif compression == 'bz2':
+		return io.BufferedWriter(BZ2Output(filename, file_mode, COMPRESS_LEVEL), buffer_size)
+	return io.open(filename, file_mode, buffering = buffer_size)
+
+
+class AllpairsWriter(object):
+	"""
+	Stream allpairs data into the [filename]_contexts and [filename]_triples files.
+	Rows are written as each article is processed through bounded output buffers
+	and the buffers are flushed to disk after every flush_every articles.
+	The on_flush callback (if given) is called with the writer after each flush.
+	With compression ('gzip' or 'bz2') the files are compressed on the fly and get the .gz or .bz2 suffix.
+	With dedup the rows are counted instead (see aggregate.SpillingCounter) and written
+	when the writer is closed as sorted unique rows with the count in the last column.
+	"""
+	def __init__(
+			self,
+			filename,
+			append = False,
+			buffer_size = OUTPUT_BUFFER_SIZE,
+			flush_every = FLUSH_EVERY,
+			on_flush = None,
+			compression = None,
+			dedup = False,
+			dedup_max_items = AGGREGATE_MAX_ITEMS):
+		if compression not in COMPRESSION_EXT:
+			raise ValueError("Unsupported compression: %s" % compression)
+		if append and dedup:
+			raise ValueError("Deduplicated output can not be appended to")
+		# file opening mode set to append if specified
+		file_mode = "ab" if append else "wb"
+		self.contexts_file = open_output(filename + '_contexts' + COMPRESSION_EXT[compression], file_mode, buffer_size, compression)
+		self.triples_file = open_output(filename + '_triples' + COMPRESSION_EXT[compression], file_mode, buffer_size, compression)
+		self.contexts_counter = SpillingCounter(dedup_max_items) if dedup else None
+		self.triples_counter = SpillingCounter(dedup_max_items) if dedup else None
+		if append and compression is None:
+			# make sure tell() reports the file size before anything is written
+			self.contexts_file.seek(0, os.SEEK_END)
+			self.triples_file.seek(0, os.SEEK_END)
+		self.flush_every = flush_every
+		self.on_flush = on_flush
+		self.article_n = 0
+	def __enter__(self):
+		return self
+	def __exit__(self, exc_type, exc_value, tb):
+		self.close()
+	def _write_rows(self, outfile, counter, rows):
+		if counter is not None:
+			counter.update(rows)
+		else:
+			write_rows(outfile, rows)
+	def write_article(self, contexts, triples):
+		"""Write the allpairs data of a single article and flush periodically."""
+		self._write_rows(self.contexts_file, self.contexts_counter, contexts)
+		self._write_rows(self.triples_file, self.triples_counter, triples)
+		self.article_n += 1
+		if self.flush_every and self.article_n % self.flush_every == 0:
+			self.flush()
+	def flush(self):
+		self.contexts_file.flush()
+		self.triples_file.flush()
+		if self.on_flush is not None:
+			self.on_flush(self)
+	def sync(self):
+		"""Make sure the flushed data is stored on disk."""
+		os.fsync(self.contexts_file.fileno())
+		os.fsync(self.triples_file.fileno())
+	def positions(self):
+		"""Return the byte positions in the contexts and triples files."""
+		return self.contexts_file.tell(), self.triples_file.tell()
+	def close(self):
+		# write out the counted rows
+		for outfile, counter in [(self.contexts_file, self.contexts_counter), (self.triples_file, self.triples_counter)]:
+			if counter is not None:
+				with counter:
+					counter.write_counts(outfile)
+		self.contexts_counter = self.triples_counter = None
+		self.contexts_file.close()
+		self.triples_file.close()
+
+
+class Checkpoint(object):
+	"""
+	Manifest of a resumable process_dir run, stored as json in [outfile]_checkpoint.
+	It records the shard of the run, how many of its (sorted) input files were processed
+	along with the name of the last one and the sizes of the output files at that point.
+	"""
+	def __init__(self, outfile):
+		self.filename = outfile + '_checkpoint'
+	def load(self):
+		"""Return the saved state or None if there is no checkpoint yet."""
+		if not os.path.exists(self.filename):
+			return None
+		with open(self.filename) as infile:
+			return json.load(infile)
+	def save(self, state):
+		"""Atomically replace the saved state."""
+		tmp_filename = self.filename + '.tmp'
+		with open(tmp_filename, 'w') as outfile:
+			json.dump(state, outfile)
+			outfile.flush()
+			os.fsync(outfile.fileno())
+		os.rename(tmp_filename, self.filename)
+
+
+def truncate_file(filename, size):
+	"""Cut the file to the given size in bytes."""
+	with open(filename, 'r+b') as outfile:
+		outfile.truncate(size)
+
+
+def list_dir_shard(directory, shard = (0, 1)):
+	"""
+	List the files in the directory in a deterministic (sorted) order.
+	For a shard (index, count) only every count-th file starting with the index-th is taken,
+	so count independent jobs together cover the directory exactly once.
+	"""
+	shard_index, shard_count = shard
+	if not 0 <= shard_index < shard_count:
+		raise ValueError("Bad shard %d of %d" % (shard_index, shard_count))
+	return sorted(os.listdir(directory))[shard_index::shard_count]
+
+
+def get_allpairs_data_file(filepath, lang):
+	"""Compute allpairs data (contexts, triples) of an annotator xml file."""
+	# read the (only) article in the file
+	[article] = get_articles_from_annotator_file(filepath)
+	return get_allpairs_data_article(article, lang=lang)
+
 
-		# read the (only) article in the file
-		[article] = get_articles_from_annotator_file(filepath)
-		# compute the allpairs data
-		cs, ts = get_allpairs_data_article(article, lang=lang)
-		# add the computed data to aggregation lists
-		contexts.extend(cs)
-		triples.extend(ts)
+def _get_allpairs_data_files(task):
+	"""Compute allpairs data for a chunk of annotator xml files (run in worker processes)."""
+	filepaths, lang = task
+	results = []
+	for filepath in filepaths:
+		cs, ts = get_allpairs_data_file(filepath, lang)
+		results.append((filepath, cs, ts))
+	return results
 
-	output_allpairs_data(outfile, contexts=contexts, triples=triples)
 
+def iter_chunks(items, chunk_size):
+	"""Split a list into consecutive chunks of at most chunk_size items."""
+	for chunk_start in xrange(0, len(items), chunk_size):
+		yield items[chunk_start:chunk_start + chunk_size]
 
-def process_file(filename, lang, outfile):
+
+def iter_allpairs_data_files(filepaths, lang, workers = 1, chunk_size = WORKER_CHUNK_SIZE):
+	"""
+	Yield (filepath, contexts, triples) for each of the given annotator xml files.
+	With more than one worker the files are processed in chunks by a process pool,
+	the results are still yielded in the order of the given file paths.
+	"""
+	if workers <= 1:
+		# one file at a time, so only the data of the current file is held in memory
+		for filepath in filepaths:
+			cs, ts = get_allpairs_data_file(filepath, lang)
+			yield filepath, cs, ts
+		return
+
+	# load the sentence splitter before forking so the workers share it instead of each loading its own copy
+	if lang is not None:
+		SENT_SPLITTER.preload([lang])
+	pool = multiprocessing.Pool(workers)
+	try:
+		tasks = ((chunk, lang) for chunk in iter_chunks(filepaths, chunk_size))
+		# imap keeps the order of the chunks so the output matches the single-process run
+		for results in pool.imap(_get_allpairs_data_files, tasks):
+			for filepath, cs, ts in results:
+				yield filepath, cs, ts
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+
+
+def process_dir(
+		directory,
+		lang,
+		outfile,
+		buffer_size = OUTPUT_BUFFER_SIZE,
+		flush_every = FLUSH_EVERY,
+		workers = 1,
+		chunk_size = WORKER_CHUNK_SIZE,
+		resume = False,
+		shard = (0, 1),
+		compression = None,
+		dedup = False):
+	"""
+	Extract allpairs data from all xml files in the given directory (or its shard).
+	The data is streamed into the output files article by article,
+	so memory use does not grow with the number of processed files.
+	Files can be processed by several worker processes, their results are merged by a single writer.
+	A checkpoint is saved with every flush; with resume the run continues from the last checkpoint
+	and any output written after it is discarded, so no rows are lost or duplicated.
+	Compressed or deduplicated output can not be truncated to a checkpoint, so it is not checkpointed.
+	"""
+	checkpointed = compression is None and not dedup
+	if resume and not checkpointed:
+		raise ValueError("Compressed or deduplicated output can not be resumed")
+	filenames = list_dir_shard(directory, shard)
+	checkpoint = Checkpoint(outfile)
+
+	state = checkpoint.load() if resume else None
+	if state is not None:
+		files_done = state['files_done']
+		# make sure the checkpoint belongs to the same run
+		if state['shard'] != list(shard) or files_done > len(filenames) or (
+				files_done > 0 and filenames[files_done - 1] != state['last_file']):
+			raise ValueError("Checkpoint %s does not match the files in %s" % (checkpoint.filename, directory))
+		# drop the output written after the checkpoint
+		truncate_file(outfile + '_contexts', state['contexts_bytes'])
+		truncate_file(outfile + '_triples', state['triples_bytes'])
+		print "resuming after %d of %d files" % (files_done, len(filenames))
+	else:
+		files_done = 0
+
+	def save_checkpoint(writer):
+		writer.sync()
+		contexts_bytes, triples_bytes = writer.positions()
+		done_n = files_done + writer.article_n
+		checkpoint.save({
+			'directory': directory,
+			'shard': list(shard),
+			'files_done': done_n,
+			'last_file': filenames[done_n - 1] if done_n > 0 else None,
+			'contexts_bytes': contexts_bytes,
+			'triples_bytes': triples_bytes})
+
+	filepaths = [os.path.join(directory, filename) for filename in filenames[files_done:]]
+	with AllpairsWriter(
+			outfile,
+			append = state is not None,
+			buffer_size = buffer_size,
+			flush_every = flush_every,
+			on_flush = save_checkpoint if checkpointed else None,
+			compression = compression,
+			dedup = dedup) as writer:
+		for filepath, cs, ts in iter_allpairs_data_files(filepaths, lang, workers, chunk_size):
+			# print progress
+			print "processing:", filepath
+			# write out the computed data right away
+			writer.write_article(cs, ts)
+		# checkpoint the finished run
+		writer.flush()
+
+
+def process_newsfeed(
+		filename,
+		lang,
+		outfile,
+		buffer_size = OUTPUT_BUFFER_SIZE,
+		flush_every = FLUSH_EVERY,
+		compression = None,
+		dedup = False):
+	"""Extract allpairs data from the articles in the given language from a Newsfeed xml dump."""
+	print "processing:", filename
+	with AllpairsWriter(
+			outfile,
+			buffer_size = buffer_size,
+			flush_every = flush_every,
+			compression = compression,
+			dedup = dedup) as writer:
+		for article in iter_articles_from_NF_file(filename, {lang}):
+			cs, ts = get_allpairs_data_article(article, lang=lang)
+			writer.write_article(cs, ts)
+
+
+def process_wikifier(
+		filename,
+		outfile,
+		buffer_size = OUTPUT_BUFFER_SIZE,
+		flush_every = FLUSH_EVERY,
+		batch_size = WIKIFIER_BATCH_SIZE,
+		compression = None,
+		dedup = False):
+	"""Extract allpairs data from a jsonl file of Wikifier-annotated articles, processed in batches."""
+	print "processing:", filename
+	articles = iter_wikifier_articles(filename)
+	with AllpairsWriter(
+			outfile,
+			buffer_size = buffer_size,
+			flush_every = flush_every,
+			compression = compression,
+			dedup = dedup) as writer:
+		while True:
+			batch = list(islice(articles, batch_size))
+			if not batch:
+				break
+			for pc, sc, ts in get_allpairs_data_wikifier_batch(batch):
+				writer.write_article(sc + [(entity, context) for (context, entity) in pc], ts)
+
+
+def process_file(filename, lang, outfile, compression = None, dedup = False):
 	"""Extract allpairs data from all xml files in the given directory."""
 	# initialize aggregation lists
 	print "processing:", filename
@@ -472,7 +974,7 @@ def process_file(filename, lang, outfile):
 	[article] = get_articles_from_annotator_file(filename)
 	contexts, triples = get_allpairs_data_article(article, lang=lang)
 
-	output_allpairs_data(outfile, contexts=contexts, triples=triples)
+	output_allpairs_data(outfile, contexts=contexts, triples=triples, compression=compression, dedup=dedup)
 
 
 
@@ -508,19 +1010,43 @@ def main():
 	# parse the input arguments
 	parser = argparse.ArgumentParser()
 	# parser.add_argument("directory", help="Path to directory with annotated article xml files.")
-	parser.add_argument("lang", help="Language of the articles (ISO code). See supported languages using the --lsl option.")
 	parser.add_argument("outfile", help="Path to output file(s). Three files will be created: [outfile]_prec, [outfile]_succ and [outfile]_triple")
 	parser.add_argument("--lsl", action="store_true", default=False, help="print supported languages and exit")
+	parser.add_argument("--compression", choices=['gzip', 'bz2'], default=None, help="compress the output files on the fly (adds a .gz or .bz2 suffix)")
+	parser.add_argument("--dedup", action="store_true", default=False, help="write each distinct row once with its count in the last column (sorted; written when processing ends)")
 	subparsers = parser.add_subparsers(help='process directory or single file?')
+	lang_help = "Language of the articles (ISO code). See supported languages using the --lsl option."
 
 	parser_dir = subparsers.add_parser('dir', help='process xmls from a given directory')
+	parser_dir.add_argument("lang", help=lang_help)
 	parser_dir.add_argument('dir_name', type=str, help='target directory name')
+	parser_dir.add_argument('--buffer_size', type=int, default=OUTPUT_BUFFER_SIZE, help='size of the output buffers in bytes (default: %(default)s)')
+	parser_dir.add_argument('--flush_every', type=int, default=FLUSH_EVERY, help='flush the output to disk after this many articles (default: %(default)s)')
+	parser_dir.add_argument('--workers', type=int, default=1, help='number of worker processes (default: %(default)s)')
+	parser_dir.add_argument('--chunk_size', type=int, default=WORKER_CHUNK_SIZE, help='number of files sent to a worker at once (default: %(default)s)')
+	parser_dir.add_argument('--resume', action='store_true', default=False, help='continue from the checkpoint saved in [outfile]_checkpoint')
+	parser_dir.add_argument('--shard', type=int, nargs=2, default=(0, 1), metavar=('INDEX', 'COUNT'), help='process only shard INDEX (0-based) of COUNT deterministic slices of the directory; use a different outfile for each shard')
 	parser_dir.set_defaults(action="process_dir")
 
 	parser_dir = subparsers.add_parser('file', help='process given xml file')
+	parser_dir.add_argument("lang", help=lang_help)
 	parser_dir.add_argument('filename', type=str, help='target xml file name')
 	parser_dir.set_defaults(action="process_file")
 
+	parser_nf = subparsers.add_parser('newsfeed', help='process articles from a (gzipped) Newsfeed xml dump')
+	parser_nf.add_argument("lang", help=lang_help)
+	parser_nf.add_argument('filename', type=str, help='Newsfeed xml(.gz) file name')
+	parser_nf.add_argument('--buffer_size', type=int, default=OUTPUT_BUFFER_SIZE, help='size of the output buffers in bytes (default: %(default)s)')
+	parser_nf.add_argument('--flush_every', type=int, default=FLUSH_EVERY, help='flush the output to disk after this many articles (default: %(default)s)')
+	parser_nf.set_defaults(action="process_newsfeed")
+
+	parser_wf = subparsers.add_parser('wikifier', help='process a (gzipped) jsonl file of Wikifier-annotated articles (sentences come from Wikifier, no lang needed)')
+	parser_wf.add_argument('filename', type=str, help='Wikifier jsonl(.gz) file name')
+	parser_wf.add_argument('--buffer_size', type=int, default=OUTPUT_BUFFER_SIZE, help='size of the output buffers in bytes (default: %(default)s)')
+	parser_wf.add_argument('--flush_every', type=int, default=FLUSH_EVERY, help='flush the output to disk after this many articles (default: %(default)s)')
+	parser_wf.add_argument('--batch_size', type=int, default=WIKIFIER_BATCH_SIZE, help='number of articles processed together (default: %(default)s)')
+	parser_wf.set_defaults(action="process_wikifier")
+
 	args = parser.parse_args()
 
 	# output supported languages
@@ -529,9 +1055,38 @@ def main():
 		exit(1)
 
 	if args.action == 'process_file':
-		process_file(args.filename, args.lang, args.outfile)
+		process_file(args.filename, args.lang, args.outfile, args.compression, args.dedup)
 	elif args.action == 'process_dir':
-		process_dir(args.dir_name, args.lang, args.outfile)
+		process_dir(
+			args.dir_name,
+			args.lang,
+			args.outfile,
+			args.buffer_size,
+			args.flush_every,
+			args.workers,
+			args.chunk_size,
+			args.resume,
+			tuple(args.shard),
+			args.compression,
+			args.dedup)
+	elif args.action == 'process_newsfeed':
+		process_newsfeed(
+			args.filename,
+			args.lang,
+			args.outfile,
+			args.buffer_size,
+			args.flush_every,
+			args.compression,
+			args.dedup)
+	elif args.action == 'process_wikifier':
+		process_wikifier(
+			args.filename,
+			args.outfile,
+			args.buffer_size,
+			args.flush_every,
+			args.batch_size,
+			args.compression,
+			args.dedup)
 
 
 if __name__ == '__main__':